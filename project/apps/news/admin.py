@@ -1,24 +1,94 @@
-import difflib
-
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.admin.models import LogEntry
-from django.contrib.auth.models import User
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.db.models import Q
 from django.shortcuts import render
 from django.http import HttpResponseRedirect
 from django.urls import reverse_lazy
+from django.utils.dateparse import parse_datetime
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
 from django_better_admin_arrayfield.admin.mixins import DynamicArrayMixin
 
+from .changes import count_changes
 from .models import News, Category, NewsAgency, NewsSiteCategory
 from .forms import AssignEditor, AssignCategory, NewsForm
+from .images import variant_url
+from .pagination import EstimatedCountPaginator
+from .roles import get_user_groups
+from .search import news_search_query
 from .tasks import collect_news_task
 
 
+class NewsChangeList(ChangeList):
+    """
+    Besides the page numbers, the news can be paged with a keyset cursor (?after=<created_time>_<id>) on the
+    default ordering, so deep pages do not OFFSET over all the rows before them.
+    """
+    cursor_var = 'after'
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = self.parse_cursor(request.GET.get(self.cursor_var))
+        super().__init__(request, *args, **kwargs)
+        # the page links and filters must not carry the cursor
+        self.params.pop(self.cursor_var, None)
+
+    @staticmethod
+    def parse_cursor(value):
+        try:
+            created_time, pk = value.rsplit('_', 1)
+            created_time = parse_datetime(created_time)
+            return (created_time, int(pk)) if created_time else None
+        except (AttributeError, ValueError):
+            return None
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(self.cursor_var, None)
+        return lookup_params
+
+    def get_queryset(self, request):
+        # chapar_category column reads the categories of every row, the admin actions get this queryset too
+        return super().get_queryset(request).for_list().prefetch_related('category')
+
+    def get_results(self, request):
+        keyset = ORDER_VAR not in self.params
+        if self.cursor and keyset:
+            created_time, pk = self.cursor
+            self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+            self.result_count = self.paginator.count
+            self.result_list = list(self.queryset.filter(
+                Q(created_time__lt=created_time) | Q(created_time=created_time, pk__lt=pk)
+            )[:self.list_per_page])
+            self.show_full_result_count = False
+            self.show_admin_actions = True
+            self.full_result_count = None
+            self.can_show_all = False
+            self.multi_page = True
+        else:
+            self.cursor = None
+            super().get_results(request)
+            self.result_list = list(self.result_list)
+
+        self.next_cursor_url = None
+        if keyset and len(self.result_list) >= self.list_per_page:
+            last = self.result_list[-1]
+            self.next_cursor_url = self.get_query_string(
+                {self.cursor_var: f'{last.created_time.isoformat()}_{last.pk}'}, [PAGE_VAR]
+            )
+
+
 @admin.register(News)
 class NewsAdmin(admin.ModelAdmin):
     form = NewsForm
+    change_list_template = "news_change_list.html"
+    list_select_related = ('editor',)
+    # the thumbnail is empty until the image variants are created, the title links to the news
+    list_display_links = ('news_title',)
+    ordering = ('-created_time', '-pk')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     radio_fields = {"status": admin.HORIZONTAL, "priority": admin.HORIZONTAL}
     search_fields = ('news_site_id', 'news_title', 'news_summary')
     fieldsets = (
@@ -34,71 +104,92 @@ class NewsAdmin(admin.ModelAdmin):
             }
         ),
         ('News Editor', {'classes': ('collapse',), 'fields': ('number_of_changes', 'editor', 'comment',)}),
-        ('News Extra', {'classes': ('collapse',), 'fields': ('wp_post_id', 'news_category', 'get_direct_link')})
+        ('News Extra', {
+            'classes': ('collapse',), 'fields': (
+                'wp_post_id', 'wp_publish_status', 'news_category', 'get_direct_link', 'duplicate_of'
+            )
+        })
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        # full text search on the indexed title and summary instead of icontains scans of search_fields
+        search_query = news_search_query(search_term)
+        if search_query is None:
+            return queryset, False
+        condition = Q(search_vector=search_query)
+        if search_term.strip().isdigit():
+            condition |= Q(news_site_id=int(search_term))
+        return queryset.filter(condition), False
+
     def get_queryset(self, request):
-        user_groups = [g.name for g in request.user.groups.all()]
+        user_groups = get_user_groups(request)
 
         if request.user.is_superuser or 'chief' in user_groups:
             return News.objects.all()
 
         elif 'monitoring' in user_groups:
-            return News.objects.filter(status__in=["void", "junk", "editable"])
+            # near-duplicates of a crawled story are reviewed once, on the first news of their cluster
+            return News.objects.filter(status__in=["void", "junk", "editable"], duplicate_of__isnull=True)
 
         return News.objects.filter(editor=request.user).filter(status__in=["assigned", "rejected"])
 
     def get_readonly_fields(self, request, obj=None):
-        user_groups = [g.name for g in request.user.groups.all()]
+        user_groups = get_user_groups(request)
         # monitor
         if 'monitoring' in user_groups:
             return (
                 "news_date", 'news_title', "news_summary", "priority", "status", "category", "news_site",
                 'get_current_news_title', 'get_current_news_summary', 'get_news_main_content', 'news_site_id',
-                'wp_post_id', 'news_category', 'editor', 'number_of_changes', 'get_direct_link', 'get_org_news_date'
+                'wp_post_id', 'news_category', 'editor', 'number_of_changes', 'get_direct_link', 'get_org_news_date',
+                'duplicate_of', 'wp_publish_status'
             )
         # superuser, chief
         elif request.user.is_superuser or 'chief' in user_groups:
             return (
                 "news_date", 'get_current_news_title', 'get_current_news_summary', 'get_news_main_content',
                 'news_site_id', 'get_direct_link', 'news_category', 'editor', 'news_site', 'number_of_changes',
-                'get_org_news_date'
+                'get_org_news_date', 'duplicate_of', 'wp_publish_status'
             )
         # editor
         return (
             "news_site", 'get_current_news_title', 'get_current_news_summary', 'get_news_main_content',
             'news_site_id', 'wp_post_id', 'news_category', 'editor', 'number_of_changes', 'get_direct_link',
-            "status", "priority", 'category', 'news_date', 'get_org_news_date'
+            "status", "priority", 'category', 'news_date', 'get_org_news_date', 'duplicate_of',
+            'wp_publish_status'
         )
 
     def get_list_display(self, request):
-        user_groups = [g.name for g in request.user.groups.all()]
+        user_groups = get_user_groups(request)
         if 'monitoring' in user_groups:
             return (
-                "news_title", "status", "created_time", "news_site", "news_category", "chapar_category", "news_date"
+                "news_thumbnail", "news_title", "status", "created_time", "news_site", "news_category",
+                "chapar_category", "news_date"
             )
         elif request.user.is_superuser or 'chief' in user_groups:
             return (
-                "news_title", "status", "priority", "created_time", "news_site", "news_category", "chapar_category",
-                "news_date", "editor", "news_site_id"
+                "news_thumbnail", "news_title", "status", "priority", "created_time", "news_site", "news_category",
+                "chapar_category", "news_date", "editor", "news_site_id"
             )
         # editor
         return (
-            "news_title", "status", "priority", "created_time", "news_site", "news_category", "chapar_category",
-            "news_date"
+            "news_thumbnail", "news_title", "status", "priority", "created_time", "news_site", "news_category",
+            "chapar_category", "news_date"
         )
 
     def get_list_filter(self, request):
-        user_groups = [g.name for g in request.user.groups.all()]
+        user_groups = get_user_groups(request)
         if 'monitoring' in user_groups:
             return "news_site", "news_date", 'priority', "category", "news_category"
         elif request.user.is_superuser or 'chief' in user_groups:
-            return "news_site", "news_date", 'priority', "editor", "status", "category", "news_category"
+            return (
+                "news_site", "news_date", 'priority', "editor", "status", "wp_publish_status", "category",
+                "news_category"
+            )
         # editor
         return "news_site", "news_date", 'priority', "category", "news_category"
 
     def get_actions(self, request):
-        user_groups = [g.name for g in request.user.groups.all()]
+        user_groups = get_user_groups(request)
         if 'editors' in user_groups:
             self.actions = []
         elif 'monitoring' in user_groups:
@@ -107,8 +198,11 @@ class NewsAdmin(admin.ModelAdmin):
             self.actions = ["assign_editor", "assign_category", 'junk_status']
         return super().get_actions(request)
 
+    def get_changelist(self, request, **kwargs):
+        return NewsChangeList
+
     def change_view(self, request, object_id, form_url='', extra_context=None):
-        user_groups = [g.name for g in request.user.groups.all()]
+        user_groups = get_user_groups(request)
         # Editors
         if 'editors' in user_groups:
             self.change_form_template = "edit_form.html"
@@ -125,8 +219,7 @@ class NewsAdmin(admin.ModelAdmin):
         return "\n".join([c.title for c in obj.category.all()])
 
     def response_change(self, request, instance):
-        editors = User.objects.filter(groups__name='editors')
-        if request.user in editors:
+        if 'editors' in get_user_groups(request):
             if "_edited" in request.POST:
                 matching_names_except_this = self.get_queryset(request).filter(
                     news_title=instance.news_title
@@ -135,12 +228,9 @@ class NewsAdmin(admin.ModelAdmin):
                 matching_names_except_this.delete()
                 instance.status = "edited"
 
-                changes = 0
-                for s in difflib.ndiff(instance.news_data.get('org_news_main'), instance.news_main_editable):
-                    if s[0] == "+" or s[0] == "-":
-                        changes += 1
-
-                instance.number_of_changes = changes
+                instance.number_of_changes = count_changes(
+                    instance.get_original().main, instance.news_main_editable
+                )
                 instance.save()
                 self.message_user(request, f"News {instance.news_title}has been Edited")
                 return HttpResponseRedirect(reverse_lazy('admin:news_news_changelist'))
@@ -155,25 +245,7 @@ class NewsAdmin(admin.ModelAdmin):
             form = AssignCategory(request.POST)
             if form.is_valid():
                 category = form.cleaned_data["category"]
-                for q in queryset:
-                    if q.category is None:
-                        news_agency = NewsAgency.objects.filter(news_website=q.news_site)
-                        news_category_agency = news_agency.get(category=category)
-                        news_website_categories = news_category_agency.news_website_categories
-                        news_website_cat = q.news_category
-                        if news_website_cat not in news_website_categories:
-                            news_website_categories.append(news_website_cat)
-                        news_category_agency.save()
-                    q.category.add(category)
-                    q.save()
-                count = len(queryset)
-                # for news_id in request.POST.getlist(admin.ACTION_CHECKBOX_NAME):
-                #     news = News.objects.get(id=news_id)
-                #     print(category.agencies.news_website_categories)
-                #     if news.news_category not in category.agencies.news_website_categories:
-                #         category.agencies.news_website_categories.append(news.news_category)
-                #         print(category.agencies.news_website_categories)
-                #         category.agencies.save()
+                count = queryset.assign_category(category)
                 self.message_user(request, f"Successfully Assigned {count} News  to {category}.")
                 return HttpResponseRedirect(request.get_full_path())
         if not form:
@@ -182,25 +254,24 @@ class NewsAdmin(admin.ModelAdmin):
     assign_category.short_description = _("Assign a Category to News")
 
     def assign_editor(self, request, queryset):
-        e_messages = []
         form = None
         if '_assign_editor' in request.POST:
             form = AssignEditor(request.POST)
-            for news in queryset.iterator():
-                if news.status != News.STATUS_EDITABLE or news.status == News.STATUS_JUNK:
-                    e_messages.append(_(
-                        f"News with id = {news.id} Could not be Assigned to Editors ---> News Status is {news.status.upper()}'."))
-                else:
-                    if form.is_valid():
-                        editor = form.cleaned_data['editor']
-                        queryset.update(editor=editor, status=News.STATUS_ASSIGNED)
-                        count = len(queryset)
-                        self.message_user(request, f"Successfully Assigned {count} News  to {editor}.")
-                        return HttpResponseRedirect(request.get_full_path())
+            if form.is_valid():
+                editor = form.cleaned_data['editor']
+                count, rejected = queryset.assign_editor(editor)
+                for status, news_ids in rejected.items():
+                    self.message_user(
+                        request,
+                        _(f"News with id = {', '.join(map(str, news_ids))} Could not be Assigned to Editors "
+                          f"---> News Status is {status.upper()}."),
+                        messages.WARNING
+                    )
+                self.message_user(request, f"Successfully Assigned {count} News  to {editor}.")
+                return HttpResponseRedirect(request.get_full_path())
         if not form:
             form = AssignEditor(initial={'_selected_action': request.POST.getlist(admin.ACTION_CHECKBOX_NAME)})
-        return render(request, 'assign_editor_form.html',
-                      {'news': queryset, 'assign_editor': form, 'e_messages': e_messages})
+        return render(request, 'assign_editor_form.html', {'news': queryset, 'assign_editor': form})
     assign_editor.short_description = _("Assign News to an Editor")
 
     def junk_status(self, request, queryset):
@@ -213,25 +284,30 @@ class NewsAdmin(admin.ModelAdmin):
 
     # Custom Fields
     def get_org_news_date(self, obj):
-        return mark_safe(f"<p>{obj.news_data.get('org_news_date')}</p>")
+        return mark_safe(f"<p>{obj.get_original().date}</p>")
     get_org_news_date.short_description = _('original news date')
 
     def get_news_main_content(self, obj):
-        return mark_safe(f"""<div dir="rtl">{obj.news_data.get('org_news_main')}</div>""")
+        return mark_safe(f"""<div dir="rtl">{obj.get_original().main}</div>""")
     get_news_main_content.short_description = _('news main')
 
     def get_current_news_summary(self, obj):
-        return mark_safe(f"<p dir='rtl'>{obj.news_data.get('org_news_summary')}</p>")
+        return mark_safe(f"<p dir='rtl'>{obj.get_original().summary}</p>")
     get_current_news_summary.short_description = _('current news summary')
 
     def get_current_news_title(self, obj):
-        return mark_safe(f"<p dir='rtl'>{obj.news_data.get('org_news_title')}</p>")
+        return mark_safe(f"<p dir='rtl'>{obj.get_original().title}</p>")
     get_current_news_title.short_description = _('current title')
 
     def get_current_image(self, obj):
-        return mark_safe(f"<p dir='rtl'>{obj.news_data.get('org_news_image')}</p>")
+        return mark_safe(f"<p dir='rtl'>{obj.get_original().image}</p>")
     get_current_image.short_description = _('current image')
 
+    def news_thumbnail(self, obj):
+        url = variant_url(obj.news_image.name, 'thumbnail') if obj.news_image else None
+        return mark_safe(f"<img src='{url}' width='80'>") if url else ''
+    news_thumbnail.short_description = _('image')
+
     def get_direct_link(self, obj):
         return mark_safe(f"<a href={obj.direct_link} target='blank'>Link</a>")
 
@@ -263,6 +339,6 @@ class LogEntryAdmin(admin.ModelAdmin):
 
 @admin.register(NewsSiteCategory)
 class NewsSiteCategoryAdmin(admin.ModelAdmin):
-    list_display = ('site_category_name', 'category', 'news_agency', 'news_url')
+    list_display = ('site_category_name', 'category', 'news_agency', 'news_url', 'poll_interval', 'next_crawl_time')
     list_filter = ('category', 'news_agency')
     list_editable = ('news_agency',)
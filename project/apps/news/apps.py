@@ -5,5 +5,5 @@ class NewsConfig(AppConfig):
     name = 'apps.news'
 
     def ready(self):
-        pass
+        from . import signals
 
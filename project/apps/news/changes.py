@@ -0,0 +1,81 @@
+import re
+
+from django.conf import settings
+
+# html tags, words and single punctuation marks
+token_re = re.compile(r'<[^>]*>|\w+|[^\w\s]')
+
+
+def tokenize(text):
+    return token_re.findall(text or '')
+
+
+def count_changes(old_text, new_text, max_changes=None):
+    """
+    Number of inserted and deleted tokens between two versions of a news text, computed with the Myers diff
+    algorithm in O((N + M) * D) time over tokens instead of characters.
+
+    Args:
+        old_text: text before editing
+        new_text: text after editing
+        max_changes: cutoff of the diff, after it the count is estimated from the furthest reaching edit path,
+                     which never counts less than the real distance, defaults to ``settings.NEWS_MAX_COUNTED_CHANGES``
+
+    Returns: number of changed tokens
+    """
+    if max_changes is None:
+        max_changes = settings.NEWS_MAX_COUNTED_CHANGES
+
+    # comparing small ints is faster than comparing strings
+    ids = {}
+    a = [ids.setdefault(token, len(ids)) for token in tokenize(old_text)]
+    b = [ids.setdefault(token, len(ids)) for token in tokenize(new_text)]
+
+    # common prefix and suffix are not changes
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+
+    return _myers_distance(a, b, max_changes)
+
+
+def _myers_distance(a, b, max_d):
+    """
+    Returns: length of the shortest edit script (insertions + deletions) of a to b, if it is longer than max_d an
+    upper bound of it, the edits of the furthest reaching max_d path plus the tokens left after its end
+    """
+    n, m = len(a), len(b)
+    if not n or not m:
+        return n + m
+
+    offset = min(max_d, n + m) + 1
+    v = [0] * (2 * offset + 1)
+    for d in range(0, offset):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return d
+
+    # every token after the end of a path is at most one more edit
+    d = offset - 1
+    estimate = n + m
+    for k in range(-d, d + 1, 2):
+        x = v[offset + k]
+        y = x - k
+        # paths of the outer diagonals may have stepped out of the edit graph
+        if x <= n and 0 <= y <= m:
+            estimate = min(estimate, d + (n - x) + (m - y))
+    return estimate
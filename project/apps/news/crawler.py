@@ -1,17 +1,28 @@
+import hashlib
 import logging
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from khayyam import JalaliDatetime
 from pytz import timezone
 from datetime import datetime
+from urllib.parse import urlparse
 
 from django.conf import settings
 from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
+from django.db import transaction
 
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
-from .models import News, NewsAgency, NewsSiteCategory
+from .dedup import find_duplicates, fingerprint
+from .extractors import Extractor, ExtractionError, Selector
+from .images import RASTER_CONTENT_TYPES
+from .models import News, NewsAgency, NewsOriginal, NewsSiteCategory
+from .search import news_search_vector
+from .tasks import create_image_variants_task
+from .utils import get_http_session, save_content_addressed
 
 
 jalali_months = ["فروردین", "اردیبهشت", "خرداد", "تیر", "مرداد", "شهریور", "مهر", "آبان", "آذر", "دی", "بهمن", "اسفند"]
@@ -19,10 +30,32 @@ jalali_months_entekhab = ['فروردين', 'ارديبهشت', 'خرداد', '
                           'اسفند']
 
 
+def make_soup(markup, parse_only=None):
+    """
+    Args:
+        markup: html text of the page
+        parse_only: optional SoupStrainer, only the matching elements (with their children) are parsed into the tree
+
+    Returns: BeautifulSoup built with the tree builder of ``settings.CRAWLER_HTML_PARSER``
+    """
+    return BeautifulSoup(markup, settings.CRAWLER_HTML_PARSER, parse_only=parse_only)
+
+
 class Crawler:
     website_name = ''
+    # SoupStrainer of the containers that collect_links() / parse_news() read, None parses the whole page
+    links_parse_only = None
+    news_parse_only = None
+    # Extractor of the news page fields, compiled once per crawler class
+    extractor = None
 
-    def __init__(self):
+    def __init__(self, category_ids=None):
+        """
+        Args:
+            category_ids: ids of the NewsSiteCategory objects to crawl, all the categories of the agency by default
+        """
+        # number of news created by the crawl
+        self.created = 0
         try:
             self.news_agency = NewsAgency.objects.get(news_website=self.website_name)
         except NewsAgency.DoesNotExist:
@@ -31,12 +64,21 @@ class Crawler:
         if self.news_agency.crawl_enable:
             logging.info(f'Starting Crawl on {self.website_name}')
 
-            # self.urls = [{ 'news_url': '<url>', 'category_id': 1 }, ...]
-            # this value is just use in collect_links() method.
-            self.urls = NewsSiteCategory.objects.filter(
+            # self.urls = [{ 'news_url': '<url>', 'category_id': 1, 'site_category_name': '<name>' }, ...]
+            # this value is used in collect_links() and get_categories_name() methods.
+            self.site_categories = list(NewsSiteCategory.objects.filter(
                 # site_category_name__in=['همدان', 'قم'],
                 news_agency=self.news_agency
-            ).values('news_url', 'category_id')
+            ).values(
+                'id', 'news_url', 'category_id', 'site_category_name', 'etag', 'last_modified', 'content_hash'
+            ))
+            self.urls = [
+                url for url in self.site_categories if category_ids is None or url['id'] in category_ids
+            ]
+            # validators of the fetched listing pages, the ones of the pages whose links are collected without error
+            # are saved with the crawled news, see fetch_listing()
+            self.fetched_listings = {}
+            self.listing_states = {}
 
             logging.debug(f"urls to crawl >>> {self.urls}")
             self.collect_news()
@@ -50,39 +92,269 @@ class Crawler:
         raise NotImplementedError()
 
     def collect_news(self):
+        defined_categories = self.get_categories_name()
+        links = self.exclude_stored_links(self.collect_links(), defined_categories)
+        items = [(url,) for url in links]
+        parsed_news = [
+            (news_site_id, defaults, links[url])
+            for (url,), (news_site_id, defaults) in self.fetch_concurrently(self.fetch_news, items)
+        ]
+        try:
+            created, duplicates = self.save_news(parsed_news, defined_categories)
+            self.created = created
+            # saved even if some news pages failed, exclude_stored_links() keeps the stored news from being fetched
+            # again and a page that always fails would make its listing parsed by every crawl
+            self.save_listing_states()
+            logging.info(f"News created: {created}, duplicates: {duplicates}, website = {self.website_name}")
+        except Exception as e:
+            logging.error(f"save news error >>> {e.args}, news site: {self.website_name}")
+
+    def fetch_listing(self, url):
+        """
+        Downloads a category listing page with a conditional request, a page that is not modified since its last
+        crawl (304 response or the same content hash) is not parsed.
+
+        Args:
+            url: item of self.urls
+
+        Returns: BeautifulSoup of the page, None if the page is not changed
+        """
+        headers = {}
+        if url['etag']:
+            headers['If-None-Match'] = url['etag']
+        if url['last_modified']:
+            headers['If-Modified-Since'] = url['last_modified']
+        page = get_http_session().get(url['news_url'], allow_redirects=False, headers=headers)
+        if page.status_code == 304:
+            logging.debug(f"listing not modified >>> {url['news_url']}")
+            return None
+
+        if page.ok:
+            content_hash = hashlib.sha256(page.content).hexdigest()
+            if content_hash == url['content_hash']:
+                logging.debug(f"listing not changed >>> {url['news_url']}")
+                return None
+            self.fetched_listings[url['id']] = dict(
+                etag=page.headers.get('ETag', '')[:255],
+                last_modified=page.headers.get('Last-Modified', '')[:64],
+                content_hash=content_hash,
+            )
+        return make_soup(page.text, self.links_parse_only)
+
+    def listing_collected(self, url):
+        """
+        Marks the links of a listing page fetched by fetch_listing() as collected without error, only the validators
+        of these pages are saved and a page with a failed link extraction is parsed again by the next crawl.
+        """
+        state = self.fetched_listings.pop(url['id'], None)
+        if state is not None:
+            self.listing_states[url['id']] = state
+
+    def save_listing_states(self):
+        # saved after the news, so the listing pages of a failed crawl are fetched and parsed again
+        for site_category_id, state in self.listing_states.items():
+            NewsSiteCategory.objects.filter(pk=site_category_id).update(**state)
+
+    def save_news(self, parsed_news, defined_categories):
+        """
+        Writes the parsed news of one crawl with bulk queries instead of a get_or_create and category.add per news.
+
+        Args:
+            parsed_news: [ (<news_site_id>, <defaults>, {<category_id>, ...}), ... ]
+            defined_categories: names of the site categories defined for this news agency
+
+        Returns: number of created and duplicate news
+        """
+        news_by_site_id = {}
+        originals = {}
+        for news_site_id, defaults, category_ids in parsed_news:
+            try:
+                news_site_id = int(news_site_id)
+            except ValueError:
+                logging.error(f"invalid news site id >>> {news_site_id}, url: {defaults.get('direct_link')}")
+                continue
+            if news_site_id not in news_by_site_id:
+                originals[news_site_id] = defaults.pop('original')
+                news_by_site_id[news_site_id] = (defaults, category_ids)
+
+        stored_site_ids = set(News.objects.filter(
+            news_site=self.website_name, news_site_id__in=list(news_by_site_id)
+        ).values_list('news_site_id', flat=True))
+
+        new_news = [
+            News(
+                news_site_id=news_site_id,
+                search_vector=news_search_vector(defaults['news_title'], defaults['news_summary']),
+                **defaults
+            )
+            for news_site_id, (defaults, _) in news_by_site_id.items() if news_site_id not in stored_site_ids
+        ]
+        for news in new_news:
+            fingerprint(news)
+
+        through_model = News.category.through
+        with transaction.atomic():
+            # rows inserted by a concurrent crawl in the meantime are skipped by the news_unique_site_id constraint
+            News.objects.bulk_create(new_news, batch_size=100, ignore_conflicts=True)
+
+            news_ids = dict(News.objects.filter(
+                news_site=self.website_name, news_site_id__in=list(news_by_site_id)
+            ).values_list('news_site_id', 'id'))
+            through_model.objects.bulk_create([
+                through_model(news_id=news_id, category_id=category_id)
+                for news_site_id, news_id in news_ids.items()
+                for category_id in news_by_site_id[news_site_id][1]
+                if news_by_site_id[news_site_id][0]['news_category'] in defined_categories
+            ], ignore_conflicts=True)
+            NewsOriginal.objects.bulk_create([
+                NewsOriginal(news_id=news_ids[news.news_site_id], **originals[news.news_site_id])
+                for news in new_news if news.news_site_id in news_ids
+            ], batch_size=100, ignore_conflicts=True)
+
+            # near-duplicates of the stored news and of each other are hidden from the monitors
+            for news in new_news:
+                news.pk = news_ids.get(news.news_site_id)
+            News.objects.bulk_update(find_duplicates(new_news), ['duplicate_of'], batch_size=100)
+
+            for name in {news.news_image.name for news in new_news if news.news_image}:
+                transaction.on_commit(lambda name=name: create_image_variants_task.delay(name))
+
+        return len(new_news), len(news_by_site_id) - len(new_news)
+
+    def exclude_stored_links(self, links, defined_categories):
+        """
+        Drops the links of already stored news with one query, before any page or image of them is requested.
+        Categories of the dropped links are still added to the stored news, like a duplicate crawled news.
+
+        Args:
+            links: [ ("<url>", <category_id>), ... ] returned by collect_links()
+            defined_categories: names of the site categories defined for this news agency
+
+        Returns: dict of links that are not stored yet and their category ids, like this { "<url>": {<category_id>} }
+        """
+        new_links = {}
+        for url, category_id in links:
+            new_links.setdefault(url, set()).add(category_id)
+
+        through_model = News.category.through
+        stored_categories = []
+        stored_news = News.objects.filter(
+            direct_link__in=list(new_links)
+        ).values_list('id', 'direct_link', 'news_category')
+        for news_id, url, news_category in stored_news:
+            category_ids = new_links.pop(url, ())
+            if news_category in defined_categories:
+                stored_categories.extend(
+                    through_model(news_id=news_id, category_id=category_id) for category_id in category_ids
+                )
+        if stored_categories:
+            through_model.objects.bulk_create(stored_categories, ignore_conflicts=True)
+
+        logging.info(
+            f"{len(new_links)} new links to crawl, {len(links) - len(new_links)} skipped, website = {self.website_name}"
+        )
+        return new_links
+
+    def fetch_concurrently(self, func, items):
+        """
+        Runs ``func(*item)`` for every item in a thread pool bounded by ``NewsAgency.crawl_concurrency``, so the
+        network wait of article pages and images overlaps instead of adding up.
+
+        Args:
+            func: callable doing the network bound work of one item
+            items: iterable of argument tuples of ``func``
+
+        Returns: generator of (item, result) in completion order, items that raise are logged and skipped
+        """
+        with ThreadPoolExecutor(max_workers=max(self.news_agency.crawl_concurrency, 1)) as executor:
+            futures = {executor.submit(func, *item): item for item in items}
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    yield item, future.result()
+                except Exception as e:
+                    logging.error(f"collect news error >>> {e.args}, url: {item[0]}, news site: {self.website_name}")
+
+    def fetch_news(self, url):
+        """
+        Downloads and parses one news page, it runs in the worker threads of fetch_concurrently().
+
+        Returns: (news_site_id, defaults) to create the News object
+        """
+        page = get_http_session().get(url, allow_redirects=False)
+        soup = make_soup(page.text, self.news_parse_only)
+        return self.parse_news(url, soup)
+
+    def parse_news(self, url, soup):
+        """
+        :return: news site id and defaults of News object, like this (<news_site_id>, {"news_title": ..., ...})
+        """
         raise NotImplementedError()
 
     def get_categories_name(self):
-        return [
-            cat.strip() for cat in NewsSiteCategory.objects.filter(
-                news_agency=self.news_agency
-            ).values_list('site_category_name', flat=True)
-        ]
+        # all the categories of the agency, a news of a crawled category page may belong to another category
+        return [url['site_category_name'].strip() for url in self.site_categories]
 
     def download_image(self, url):
         """
+        Streams the image to a temporary file in chunks, so the worker never holds the whole image in memory.
+        Responses that are not raster images Pillow can process or are bigger than ``settings.CRAWLER_MAX_IMAGE_SIZE``
+        are dropped.
+
         Args:
             url: url of news image that takes from page
-            defaults: data for create a new field
 
-        Returns: Image <django.core.files.File> to save in ImageField <news_image>
+        Returns: name of the stored image to save in ImageField <news_image>, or "" if the image is dropped
         """
-        r = requests.get(url, allow_redirects=False)
-        img_temp = NamedTemporaryFile(delete=True)
-        img_temp.write(r.content)
-        img_temp.flush()  # deleting the file from RAM
-        return File(img_temp, name=url.split('/')[-1])
+        with get_http_session().get(url, allow_redirects=False, stream=True) as r:
+            content_type = r.headers.get('Content-Type', '').split(';')[0].strip()
+            if not r.ok or content_type not in RASTER_CONTENT_TYPES:
+                logging.warning(f"news image dropped >>> status: {r.status_code}, type: {content_type}, url: {url}")
+                return ''
+            if int(r.headers.get('Content-Length') or 0) > settings.CRAWLER_MAX_IMAGE_SIZE:
+                logging.warning(f"news image dropped >>> size: {r.headers['Content-Length']}, url: {url}")
+                return ''
+
+            digest = hashlib.sha256()
+            size = 0
+            img_temp = NamedTemporaryFile(delete=True)
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > settings.CRAWLER_MAX_IMAGE_SIZE:
+                    logging.warning(f"news image dropped >>> size: more than {size}, url: {url}")
+                    img_temp.close()
+                    return ''
+                digest.update(chunk)
+                img_temp.write(chunk)
+            img_temp.flush()
+
+        extension = os.path.splitext(urlparse(url).path)[1].lower() or mimetypes.guess_extension(content_type) or ''
+        with img_temp:
+            return save_content_addressed(File(img_temp), digest.hexdigest(), extension)
 
 
 class ILNACrawler(Crawler):
     website_name = 'ilna.news'
+    links_parse_only = SoupStrainer(class_=["defloat firstDIV center", "seclevel_news mb8 mt16 clearbox", "pb32"])
+    # news pages are parsed whole, the date is the second <time> of the page wherever it is
+    extractor = Extractor({
+        'news_site_id': Selector(class_="inlineblock ml16", find="span", get='text'),
+        'sh_news_str_date': Selector("time", index=1, get='strip'),
+        'news_str_date': Selector("time", index=1, get='@datetime'),
+        'news_category': Selector("a", class_="float ml4 mr4", index=-1, get='text'),
+        'news_title': Selector("h1", class_="fb fn22 news_title mt8 mb8", get='strip'),
+        'news_summary': Selector("p", class_="fn14 news_lead pr8 pl8 pt8 pb8", get='text'),
+        'news_main': Selector("section", class_="article_body mt16 clearbox fn14 content", many="p", get='html'),
+        'image_url': Selector("section", class_="article_body mt16 clearbox fn14 content", find="img", get='@src'),
+    })
 
     def collect_links(self):
         news_links = []
         for url in self.urls:
             try:
-                page = requests.get(url['news_url'], allow_redirects=False)
-                soup = BeautifulSoup(page.text, "html.parser")
+                soup = self.fetch_listing(url)
+                if soup is None:
+                    continue
 
                 first_news = soup.find(class_="defloat firstDIV center").find("a").attrs["href"]
                 news_links.append((f"https://www.ilna.news{first_news}", url['category_id']))
@@ -95,193 +367,164 @@ class ILNACrawler(Crawler):
                 news_list = soup.find(class_="pb32").find_all("li")
                 for news in news_list:
                     news_links.append((f"https://www.ilna.news{news.find('a').attrs['href']}", url['category_id']))
+                self.listing_collected(url)
             except Exception as e:
                 logging.error(f"collect links >>> {e.args}")
 
         return news_links
 
-    def collect_news(self):
-        urls = self.collect_links()
-        defined_categories = self.get_categories_name()
-        for url, category_id in urls:
-            try:
-                page = requests.get(url, allow_redirects=False)
-                soup = BeautifulSoup(page.text, "html.parser")
-
-                news_site_id = int(soup.find(class_="inlineblock ml16").find("span").get_text())
-
-                sh_news_str_date = soup.find_all("time")[1].get_text().strip()
-
-                news_str_date = soup.find_all("time")[1].attrs['datetime']  # 2020-09-12T04:35:03Z
-                news_date = datetime.strptime(f'{news_str_date[:-1]}+0000', "%Y-%m-%dT%H:%M:%S%z")
-                news_category = soup.find_all("a", class_="float ml4 mr4")[-1].get_text()
-                news_title = soup.find("h1", class_="fb fn22 news_title mt8 mb8").get_text().strip()
-                news_summary = soup.find("p", class_="fn14 news_lead pr8 pl8 pt8 pb8").text
-                news_main_soup = soup.find("section", class_="article_body mt16 clearbox fn14 content").find_all("p")
-                news_main = str()
-
-                for i in range(1, len(news_main_soup)):
-                    news_main_soup[i] = str(news_main_soup[i])
-                    news_main += news_main_soup[i]
-
-                image_url = soup.find(
-                    "section", class_="article_body mt16 clearbox fn14 content"
-                ).find("img").attrs["src"]
-
-                # final data to save
-                defaults = {
-                    'direct_link': url,
-                    "news_category": news_category,
-                    "news_title": news_title,
-                    "news_site": "ilna.news",
-                    "news_main_editable": news_main,
-                    "news_summary": news_summary,
-                    "news_date": news_date,
-                    # download news image
-                    "news_image": self.download_image(image_url),
-                    # Raw data of news
-                    "news_data": dict(
-                        org_news_image=image_url,
-                        org_news_title=news_title,
-                        org_news_main=news_main,
-                        org_news_summary=news_summary,
-                        org_news_date=sh_news_str_date
-                    )
-                }
-
-                # creating news ...
-                news, _created = News.objects.get_or_create(news_site_id=news_site_id, defaults=defaults)
-                # adding the categories of news
-                if news_category in defined_categories:
-                    news.category.add(category_id)
-                # success log
-                if _created:
-                    logging.info(f"New news created!, id = {news_site_id}, website = ilna.news")
-                else:
-                    logging.info(f"Duplicate news!, id = {news_site_id}, website = ilna.news")
-            except Exception as e:
-                logging.error(f"collect news error >>> {e.args}, url: {url}, news site: {self.website_name}")
+    def parse_news(self, url, soup):
+        data = self.extractor.extract(soup)
+        news_site_id = int(data['news_site_id'])
+
+        news_str_date = data['news_str_date']  # 2020-09-12T04:35:03Z
+        news_date = datetime.strptime(f'{news_str_date[:-1]}+0000', "%Y-%m-%dT%H:%M:%S%z")
+        news_main = "".join(data['news_main'][1:])
+        image_url = data['image_url']
+
+        # final data to save
+        return news_site_id, {
+            'direct_link': url,
+            "news_category": data['news_category'],
+            "news_title": data['news_title'],
+            "news_site": "ilna.news",
+            "news_main_editable": news_main,
+            "news_summary": data['news_summary'],
+            "news_date": news_date,
+            # download news image
+            "news_image": self.download_image(image_url),
+            # Raw data of news, stored in NewsOriginal
+            "original": dict(
+                image=image_url,
+                title=data['news_title'],
+                main=news_main,
+                summary=data['news_summary'],
+                date=data['sh_news_str_date']
+            )
+        }
 
 
 class ISNACrawler(Crawler):
     website_name = 'isna.ir'
+    links_parse_only = SoupStrainer(class_=[
+        "box card no-header horizontal full-card _cyan has-more has-more-bottom has-more-default has-more-centered",
+        "box card no-header cols cols-3 cols-equal has-more _purple",
+    ])
+    # news pages are parsed whole, the news main is every <p> after item-text up to the end of the page
+    extractor = Extractor({
+        'news_title_meta': Selector(class_="title-meta", get='strip'),
+        'news_text_meta': Selector(class_="text-meta", get='strip'),
+        'news_category': Selector(class_="text-meta", index=1, get='strip'),
+        'news_title': Selector('h1', class_="first-title", get='text'),
+        'news_main': Selector(class_="item-text", following="p", get='html'),
+        'news_summary': Selector(class_="summary", get='text'),
+        'image_url': Selector(class_="item-img img-md", find="img", get='@src'),
+    })
 
     def collect_links(self):
-        all_a = ''
         news_links = []
         for url in self.urls:
-            page = requests.get(url['news_url'], allow_redirects=False)
-            soup = BeautifulSoup(page.text, 'html.parser')
+            soup = self.fetch_listing(url)
+            if soup is None:
+                continue
+            collected = True
 
+            # a listing page may use only one of the two layouts, a missing one has no links
             # style 1
             news_list_1 = soup.find('section', attrs={'class': "box card no-header horizontal full-card _cyan has-more has-more-bottom has-more-default has-more-centered"})
             try:
-                all_a = news_list_1.find_all("a")
-            except Exception as e:
-                logging.error(f"-- 1 collect links error >>> {e.args}, url: {url.get('news_url')}, {self.website_name}")
-
-            try:
+                all_a = news_list_1.find_all("a") if news_list_1 is not None else []
                 for a in all_a:
                     if a.find("img"):
                         news_links.append((f"https://www.isna.ir{a.attrs['href']}", url['category_id']))
             except Exception as e:
-                logging.error(f"2 collect links error >>> {e.args}, url: {url}")
+                collected = False
+                logging.error(f"-- 1 collect links error >>> {e.args}, url: {url.get('news_url')}, {self.website_name}")
 
             # style 2
             try:
                 news_list_2 = soup.find(
                     class_="box card no-header cols cols-3 cols-equal has-more _purple")
-                links = news_list_2.find_all("li")
+                links = news_list_2.find_all("li") if news_list_2 is not None else []
                 for link in links:
                     anchor = link.find("a").attrs['href']
                     news_links.append((f"https://www.isna.ir{anchor}", url['category_id']))
             except Exception as e:
+                collected = False
                 logging.error(f"-- 2 collect links error >>> {e.args}, url: {url}")
 
+            if collected:
+                self.listing_collected(url)
+
         result = list(set(news_links))
         logging.debug(f"urls found {result}")
         return result
 
-    def collect_news(self):
-        urls = self.collect_links()
-        defined_categories = self.get_categories_name()
-        for url, category_id in urls:
-            page = requests.get(url, allow_redirects=False)
-            soup = BeautifulSoup(page.text, 'html.parser')
-
-            try:
-                news_jalali_date = soup.find(class_="title-meta").get_text().strip() + soup.find(
-                    class_="text-meta").get_text().strip()
-                jalali_date_list = news_jalali_date.strip().split("/")
-                jalali_date_details = jalali_date_list[1].split(" ")  # date
-                jalali_time_details = jalali_date_list[2].split(':')  # time
-
-                news_date = JalaliDatetime(
-                    int(jalali_date_details[2]),
-                    jalali_months.index(jalali_date_details[1]) + 1,
-                    int(jalali_date_details[0]),
-                    int(jalali_time_details[0]),
-                    int(jalali_time_details[1]),
-                    tzinfo=timezone(settings.TIME_ZONE)
-                ).todatetime()
-
-                news_category = soup.find_all(class_="text-meta")[1].get_text().strip()
-                news_site_id = url.split("/")[4]
-                news_title = soup.find('h1', class_="first-title").get_text()
-
-                news_main_text = (soup.find(class_="item-text"))
-                news_main_text = news_main_text.find_all_next("p")
-                news_main_text = list(news_main_text)
-                for i in range(len(news_main_text)):
-                    news_main_text[i] = str(news_main_text[i])
-
-                news_summary = soup.find(class_="summary").text
-
-                image_url = soup.find(class_="item-img img-md").find("img").attrs["src"]
-                # downloading news image
-                news_image = self.download_image(image_url)
-
-                news, _created = News.objects.get_or_create(
-                    news_site_id=news_site_id,
-                    defaults={
-                        'direct_link': url,
-                        "news_category": news_category,
-                        "news_title": news_title,
-                        "news_site": "isna.ir",
-                        "news_main_editable": "".join(news_main_text),
-                        "news_summary": news_summary,
-                        "news_date": news_date,
-                        "news_image": news_image,
-                        # Raw data of news
-                        "news_data": dict(
-                            org_news_image=image_url,
-                            org_news_title=news_title,
-                            org_news_main="".join(news_main_text),
-                            org_news_summary=news_summary,
-                            org_news_date=news_jalali_date
-                        )
-                    }
-                )
-                if news_category in defined_categories:
-                    news.category.add(category_id)
-
-                if _created:
-                    logging.info(f"News created!, id = {news_site_id}, website = isna.ir")
-                else:
-                    logging.info(f"Duplicate news!, id = {news_site_id}, website = isna.ir")
-            except Exception as e:
-                logging.error(f"collect news error >>> {e.args}, url: {url}")
+    def parse_news(self, url, soup):
+        data = self.extractor.extract(soup)
+        news_jalali_date = data['news_title_meta'] + data['news_text_meta']
+        jalali_date_list = news_jalali_date.strip().split("/")
+        jalali_date_details = jalali_date_list[1].split(" ")  # date
+        jalali_time_details = jalali_date_list[2].split(':')  # time
+
+        news_date = JalaliDatetime(
+            int(jalali_date_details[2]),
+            jalali_months.index(jalali_date_details[1]) + 1,
+            int(jalali_date_details[0]),
+            int(jalali_time_details[0]),
+            int(jalali_time_details[1]),
+            tzinfo=timezone(settings.TIME_ZONE)
+        ).todatetime()
+
+        news_site_id = url.split("/")[4]
+        news_main = "".join(data['news_main'])
+        image_url = data['image_url']
+        # downloading news image
+        news_image = self.download_image(image_url)
+
+        return news_site_id, {
+            'direct_link': url,
+            "news_category": data['news_category'],
+            "news_title": data['news_title'],
+            "news_site": "isna.ir",
+            "news_main_editable": news_main,
+            "news_summary": data['news_summary'],
+            "news_date": news_date,
+            "news_image": news_image,
+            # Raw data of news, stored in NewsOriginal
+            "original": dict(
+                image=image_url,
+                title=data['news_title'],
+                main=news_main,
+                summary=data['news_summary'],
+                date=news_jalali_date
+            )
+        }
 
 
 class ENTEKHABCrawler(Crawler):
     website_name = 'entekhab.ir'
+    links_parse_only = SoupStrainer(class_=["Htags", "im-news col-xs-36 section_paged_main_content_div"])
+    extractor = Extractor({
+        'news_site_id': Selector("div", class_="news_id_c", get='text'),
+        'news_jalali_date': Selector("div", class_="news_pdate_c", get='text'),
+        'news_category': Selector(class_="news_path", many="a", get='strip'),
+        'news_title': Selector("h1", class_="title col-xs-36", get='strip'),
+        'news_summary': Selector('div', class_="subtitle", get='text'),
+        'news_main': Selector(class_="body col-xs-36", many=['a', 'p'], get='html'),
+        'news_image': Selector("img", class_="image_btn", get='@src', required=False),
+        'news_corner_image': Selector("img", class_="news_corner_image", get='@src', required=False),
+    })
+    # every field of the news page is looked up by class, the other elements are not needed
+    news_parse_only = extractor.parse_only()
 
     def collect_links(self):
         entekhab_news_links = []
         for url in self.urls:
             try:
-                page = requests.get(url['news_url'], allow_redirects=False)
-                soup = BeautifulSoup(page.text, 'html.parser')
+                soup = self.fetch_listing(url)
+                if soup is None:
+                    continue
 
                 article_link = soup.find('h2', class_='Htags')
                 entekhab_news_links.append(
@@ -292,90 +535,61 @@ class ENTEKHABCrawler(Crawler):
 
                 for news in news_list:
                     entekhab_news_links.append((f"https://www.entekhab.ir{news.attrs['href']}", url['category_id']))
+                self.listing_collected(url)
             except Exception as e:
                 logging.error(f"collect links error >>> {e.args}, url: {url}")
 
         return entekhab_news_links
 
-    def collect_news(self):
-        urls = self.collect_links()
-        defined_categories = self.get_categories_name()
-        for url, category_id in urls:
-            try:
-                page = requests.get(url, allow_redirects=False)
-                soup = BeautifulSoup(page.text, "html.parser")
-
-                news_site_id = soup.find("div", class_="news_id_c").get_text().split(" ")[-1]
-
-                news_jalali_date = soup.find("div", class_="news_pdate_c").get_text().split('ر:')[-1].strip()
-
-                news_category_a = soup.find(class_="news_path").find_all("a")
-                news_category = []
-                for a in news_category_a:
-                    news_category.append(a.get_text().strip())
-
-                news_category = news_category[0]
-                news_title = soup.find("h1", class_="title col-xs-36").get_text().strip()
-                news_summary = soup.find('div', class_="subtitle").text
-                news_main = soup.find(class_="body col-xs-36").find_all(['a', 'p'])
-
-                for i in range(len(news_main)):
-                    news_main[i] = str(news_main[i])
-
-                news_main = "".join(news_main)
-
-                # date
-                news_date = news_jalali_date.split("-")[1].strip().split(" ")
-                news_date_day = int(news_date[0])
-                news_date_month = jalali_months_entekhab.index(news_date[1]) + 1
-                news_date_year = int(news_date[-1])
-
-                # time
-                news_time = news_jalali_date.split("-")[0].strip().split(' : ')
-                news_date = JalaliDatetime(
-                    news_date_year,
-                    news_date_month,
-                    news_date_day,
-                    int(news_time[1]),
-                    int(news_time[0]),
-                    tzinfo=timezone(settings.TIME_ZONE)
-                ).todatetime()
-
-                news_image = soup.find("img", class_="image_btn")
-
-                if news_image:
-                    news_image = news_image.attrs["src"]
-                else:
-                    news_image = soup.find("img", class_="news_corner_image").attrs["src"]
-                image_url = f"https://www.entekhab.ir{news_image}"
-                news_image = self.download_image(image_url)
-
-                news, _created = News.objects.get_or_create(
-                    news_site_id=news_site_id,
-                    defaults={
-                        'direct_link': url,
-                        "news_category": news_category,
-                        "news_title": news_title,
-                        "news_site": "entekhab.ir",
-                        "news_main_editable": news_main,
-                        "news_summary": news_summary,
-                        "news_date": news_date,
-                        "news_image": news_image,
-                        # Raw data of news
-                        "news_data": dict(
-                            org_news_image=image_url,
-                            org_news_title=news_title,
-                            org_news_main=news_main,
-                            org_news_summary=news_summary,
-                            org_news_date=news_jalali_date
-                        )
-                    }
-                )
-                if news_category in defined_categories:
-                    news.category.add(category_id)
-                logging.info(f"news created!, id = {news_site_id}, website = entekhab.ir")
-            except Exception as e:
-                logging.error(f"collect links error >>> {e.args}, url: {url}")
+    def parse_news(self, url, soup):
+        data = self.extractor.extract(soup)
+        news_site_id = data['news_site_id'].split(" ")[-1]
+
+        news_jalali_date = data['news_jalali_date'].split('ر:')[-1].strip()
+        news_category = data['news_category'][0]
+        news_main = "".join(data['news_main'])
+
+        # date
+        news_date = news_jalali_date.split("-")[1].strip().split(" ")
+        news_date_day = int(news_date[0])
+        news_date_month = jalali_months_entekhab.index(news_date[1]) + 1
+        news_date_year = int(news_date[-1])
+
+        # time
+        news_time = news_jalali_date.split("-")[0].strip().split(' : ')
+        news_date = JalaliDatetime(
+            news_date_year,
+            news_date_month,
+            news_date_day,
+            int(news_time[1]),
+            int(news_time[0]),
+            tzinfo=timezone(settings.TIME_ZONE)
+        ).todatetime()
+
+        news_image = data['news_image'] or data['news_corner_image']
+        if not news_image:
+            raise ExtractionError('news_image not found')
+        image_url = f"https://www.entekhab.ir{news_image}"
+        news_image = self.download_image(image_url)
+
+        return news_site_id, {
+            'direct_link': url,
+            "news_category": news_category,
+            "news_title": data['news_title'],
+            "news_site": "entekhab.ir",
+            "news_main_editable": news_main,
+            "news_summary": data['news_summary'],
+            "news_date": news_date,
+            "news_image": news_image,
+            # Raw data of news, stored in NewsOriginal
+            "original": dict(
+                image=image_url,
+                title=data['news_title'],
+                main=news_main,
+                summary=data['news_summary'],
+                date=news_jalali_date
+            )
+        }
 
 
 def add_category():
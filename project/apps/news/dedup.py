@@ -0,0 +1,123 @@
+import hashlib
+import random
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import News
+from .search import normalize, word_re
+
+# 16 bands of 4 rows, news with an estimated similarity of 0.6 share a band with a probability of about 0.9
+BANDS = 16
+ROWS = 4
+NUM_PERM = BANDS * ROWS
+SHINGLE_SIZE = 3
+
+# permutations are fixed, signatures stored in the database must stay comparable across processes and deploys
+_prime = (1 << 61) - 1
+_rng = random.Random(20200901)
+_permutations = [(_rng.randrange(1, _prime), _rng.randrange(0, _prime)) for _ in range(NUM_PERM)]
+
+tag_re = re.compile(r'<[^>]*>')
+
+
+def _hash64(data, signed=False):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big', signed=signed)
+
+
+def shingles(text):
+    """
+    Returns: set of the hashed word n-grams of the normalized text, html tags are dropped
+    """
+    words = word_re.findall(normalize(tag_re.sub(' ', text or '')))
+    if not words:
+        return set()
+    return {
+        _hash64(' '.join(words[i:i + SHINGLE_SIZE]).encode())
+        for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))
+    }
+
+
+def minhash_signature(text):
+    """
+    Returns: list of NUM_PERM minimum hashes of the text shingles, None if the text has no words
+    """
+    hashes = shingles(text)
+    if not hashes:
+        return None
+    return [min((a * h + b) % _prime for h in hashes) for a, b in _permutations]
+
+
+def lsh_bands(signature):
+    """
+    Returns: one key per band of the signature, news sharing any key are near-duplicate candidates
+    """
+    return [
+        _hash64(f'{band}:{signature[band * ROWS:(band + 1) * ROWS]}'.encode(), signed=True)
+        for band in range(BANDS)
+    ]
+
+
+def similarity(signature, other):
+    """
+    Returns: estimated jaccard similarity of the shingles of two signatures
+    """
+    return sum(x == y for x, y in zip(signature, other)) / NUM_PERM
+
+
+def fingerprint(news):
+    """
+    Fills minhash and lsh_bands of an unsaved news from its title, summary and main content.
+    """
+    news.minhash = minhash_signature(' '.join((news.news_title, news.news_summary, news.news_main_editable)))
+    news.lsh_bands = lsh_bands(news.minhash) if news.minhash else None
+
+
+def find_duplicates(news_list):
+    """
+    Clusters saved news with the news of the last ``settings.NEWS_DUPLICATE_WINDOW`` hours and with each other.
+    A duplicate points to the first news of its cluster, so monitors review every story once.
+
+    Args:
+        news_list: fingerprinted news with primary keys, in the order they are crawled
+
+    Returns: list of the news that are near-duplicates, with duplicate_of_id set
+    """
+    news_list = [news for news in news_list if news.pk and news.minhash]
+    if not news_list:
+        return []
+
+    candidates = News.objects.filter(
+        lsh_bands__overlap=list({key for news in news_list for key in news.lsh_bands}),
+        created_time__gte=timezone.now() - timedelta(hours=settings.NEWS_DUPLICATE_WINDOW),
+    ).exclude(
+        pk__in=[news.pk for news in news_list]
+    ).order_by('created_time', 'id').values_list('id', 'duplicate_of_id', 'minhash', 'lsh_bands')
+
+    # band key: [(id, cluster id, signature), ...]
+    index = {}
+    for pk, duplicate_of_id, signature, bands in candidates:
+        for key in bands:
+            index.setdefault(key, []).append((pk, duplicate_of_id or pk, signature))
+
+    duplicates = []
+    for news in news_list:
+        best, cluster_id = settings.NEWS_DUPLICATE_THRESHOLD, None
+        seen = set()
+        for key in news.lsh_bands:
+            for pk, cluster, signature in index.get(key, ()):
+                if pk in seen:
+                    continue
+                seen.add(pk)
+                score = similarity(news.minhash, signature)
+                if score >= best:
+                    best, cluster_id = score, cluster
+
+        if cluster_id is not None:
+            news.duplicate_of_id = cluster_id
+            duplicates.append(news)
+        for key in news.lsh_bands:
+            index.setdefault(key, []).append((news.pk, cluster_id or news.pk, news.minhash))
+    return duplicates
@@ -0,0 +1,150 @@
+from bs4 import SoupStrainer, Tag
+
+
+class ExtractionError(ValueError):
+    pass
+
+
+class Selector:
+    """
+    Declarative lookup of one field of a page.
+
+    Args:
+        name: tag name of the element, None matches any tag
+        class_: class of the element, matched like ``soup.find(class_=...)`` (a single class or the whole attribute)
+        index: which match to use, 0 is the first one and -1 the last one, None uses all the matches as a list
+        find: tag name to look up inside the matched element, like ``element.find(find)``
+        many: tag name or list of tag names to look up inside the matched element, like ``element.find_all(many)``
+        following: tag name of all the elements after the matched element, like ``element.find_all_next(following)``
+        get: value to return for each element, "text" (get_text()), "strip" (stripped get_text()),
+             "html" (str(element)), "@<attribute>" (value of attribute) or None to return the element itself
+        required: raise ExtractionError when nothing matches, otherwise the value is None
+    """
+
+    def __init__(self, name=None, class_=None, index=0, find=None, many=None, following=None, get=None,
+                 required=True):
+        if name is None and class_ is None:
+            raise ValueError('Selector needs a tag name or a class')
+        if following and (index is None or index < 0):
+            raise ValueError('Selector with following needs a non-negative index')
+        self.name = name
+        self.class_ = class_
+        self.index = index
+        self.find = find
+        self.many = many
+        self.following = following
+        self.get = get
+        self.required = required
+
+    def matches(self, tag):
+        return self.name is None or tag.name == self.name
+
+    def value(self, element):
+        if self.get is None:
+            return element
+        if self.get == 'text':
+            return element.get_text()
+        if self.get == 'strip':
+            return element.get_text().strip()
+        if self.get == 'html':
+            return str(element)
+        if self.get.startswith('@'):
+            return element.attrs[self.get[1:]]
+        raise ValueError(f'unknown selector output: {self.get}')
+
+
+class Extractor:
+    """
+    Compiled set of Selectors of one website, built once and reused for every page.
+
+    The selectors are indexed by class and tag name, so extract() finds the elements of all fields with one pass
+    over the tree instead of a find()/find_all() scan per field.
+    """
+
+    def __init__(self, spec):
+        """
+        Args:
+            spec: dict of { '<field name>': Selector(...), ... }
+        """
+        self.spec = spec
+        self.by_class = {}
+        self.by_name = {}
+        for field, selector in spec.items():
+            if selector.class_ is not None:
+                self.by_class.setdefault(selector.class_, []).append(field)
+            else:
+                self.by_name.setdefault(selector.name, []).append(field)
+
+    def extract(self, soup):
+        """
+        Returns: dict of { '<field name>': <value>, ... }, the value of selectors with ``many``, ``following`` or
+        ``index=None`` is a list
+        """
+        matches = {field: [] for field in self.spec}
+        following = {}
+
+        for tag in soup.descendants:
+            if not isinstance(tag, Tag):
+                continue
+
+            for field, elements in following.items():
+                if tag.name == self.spec[field].following:
+                    elements.append(tag)
+
+            for field in self._candidates(tag):
+                selector = self.spec[field]
+                if selector.matches(tag):
+                    matches[field].append(tag)
+                    if selector.following and len(matches[field]) == selector.index + 1:
+                        following[field] = []
+
+        return {field: self._value(field, matches[field], following) for field in self.spec}
+
+    def parse_only(self):
+        """
+        Returns: SoupStrainer of the elements of all fields, classes are matched like the selectors, a single class
+        or the whole attribute. Only for specs whose selectors all have a class and no ``following``.
+        """
+        if any(selector.class_ is None or selector.following for selector in self.spec.values()):
+            raise ValueError('parse_only needs a class on every selector and no following')
+
+        def match(value):
+            # the strainer sees the raw attribute, before it is split into classes
+            return value is not None and any(key in self.by_class for key in value.split() + [value])
+
+        return SoupStrainer(class_=match)
+
+    def _candidates(self, tag):
+        candidates = list(self.by_name.get(tag.name, ()))
+        classes = tag.get('class')
+        if classes:
+            if isinstance(classes, str):
+                classes = classes.split()
+            for key in set(classes) | {" ".join(classes)}:
+                candidates.extend(self.by_class.get(key, ()))
+        return candidates
+
+    def _value(self, field, elements, following):
+        selector = self.spec[field]
+        if selector.index is None:
+            if selector.find:
+                elements = [e.find(selector.find) for e in elements]
+            return [selector.value(e) for e in elements if e is not None]
+
+        try:
+            element = elements[selector.index]
+        except IndexError:
+            element = None
+
+        if element is not None:
+            if selector.following:
+                return [selector.value(e) for e in following.get(field, [])]
+            if selector.many:
+                return [selector.value(e) for e in element.find_all(selector.many)]
+            if selector.find:
+                element = element.find(selector.find)
+        if element is None:
+            if selector.required:
+                raise ExtractionError(f'{field} not found')
+            return None
+        return selector.value(element)
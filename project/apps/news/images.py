@@ -0,0 +1,93 @@
+import hashlib
+import io
+import logging
+import os
+import re
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from PIL import Image
+
+logger = logging.getLogger(__file__)
+
+# variant: (max width, max height, jpeg quality)
+VARIANTS = {
+    'publish': (1200, 1200, 82),
+    'thumbnail': (160, 160, 70),
+}
+
+# image types that Pillow decodes, news images of other types (e.g. svg) are not downloaded
+RASTER_CONTENT_TYPES = {
+    'image/jpeg', 'image/jpg', 'image/pjpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'image/tiff',
+}
+
+content_hash_re = re.compile(r'^[0-9a-f]{64}$')
+
+
+def image_key(name, storage=default_storage):
+    """
+    Returns: content hash of the stored image, read from the name of content addressed images and computed for
+    the images stored before them
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if content_hash_re.match(stem):
+        return stem
+    digest = hashlib.sha256()
+    with storage.open(name, 'rb') as f:
+        for chunk in f.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def variant_name(key, variant):
+    return f'images/variants/{key[:2]}/{key}_{variant}.jpg'
+
+
+def create_variant(name, variant, storage=default_storage):
+    """
+    Creates the resized and recompressed jpeg variant of an image, variants are cached in the storage by the image
+    hash, so an image used by many news is processed once.
+
+    Args:
+        name: name of the stored original image
+        variant: one of the VARIANTS keys
+
+    Returns: name of the stored variant
+    """
+    width, height, quality = VARIANTS[variant]
+    target = variant_name(image_key(name, storage), variant)
+    if storage.exists(target):
+        return target
+
+    with storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        # lets the jpeg decoder downscale while decoding instead of loading the full resolution image
+        image.draft('RGB', (width, height))
+        image = image.convert('RGB')
+        image.thumbnail((width, height), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return storage.save(target, ContentFile(buffer.getvalue()))
+
+
+def create_variants(name, storage=default_storage):
+    for variant in VARIANTS:
+        try:
+            create_variant(name, variant, storage)
+        except Exception as e:
+            logger.error(f'[creating image variant failed]-[image: {name}, variant: {variant}, error: {e.args}]')
+
+
+def variant_url(name, variant, storage=default_storage):
+    """
+    Returns: url of an already created variant of a content addressed image, None if it is not available yet
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if not content_hash_re.match(stem):
+        return None
+    target = variant_name(stem, variant)
+    if storage.exists(target):
+        return storage.url(target)
+    return None
@@ -1,12 +1,73 @@
-from django.contrib.postgres.fields import JSONField
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex, HashIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
 from django.contrib.auth.models import User, Group
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 
+from .search import news_search_vector
 from .utils import UploadTo
 
 
+class NewsQuerySet(models.QuerySet):
+    # big text/json columns, only the change form, the crawlers and the wordpress publishing need them
+    heavy_fields = ('news_main_editable', 'news_summary', 'news_data', 'search_vector', 'minhash', 'lsh_bands')
+
+    def for_list(self):
+        """
+        Rows of list pages and bulk admin actions (changelist, assign editor/category, status actions)
+        """
+        return self.defer(*self.heavy_fields)
+
+    def for_sync(self):
+        """
+        Rows of the wordpress sync, it compares the original news main with the post content.
+        news_data is kept, the news crawled before NewsOriginal read their original from it (it is empty for the
+        others), deferring it would cost a query per legacy news. Once tasks.move_news_originals has run it is empty
+        for all the news.
+        """
+        return self.defer(*(field for field in self.heavy_fields if field != 'news_data')).select_related('original')
+
+    def assign_editor(self, editor):
+        """
+        Assigns the editable news of the queryset to the editor with a fixed number of queries, whatever its size.
+
+        Returns: number of assigned news and the ids of the rejected news by their status, like this
+                 (<count>, {"<status>": [<id>, ...]})
+        """
+        queryset = self.prefetch_related(None).order_by()
+        with transaction.atomic():
+            rejected = {}
+            for news_id, status in queryset.exclude(status=News.STATUS_EDITABLE).values_list('id', 'status'):
+                rejected.setdefault(status, []).append(news_id)
+            # the status is checked again by the update itself, a news changed in the meantime is never assigned
+            count = queryset.filter(status=News.STATUS_EDITABLE).update(editor=editor, status=News.STATUS_ASSIGNED)
+        return count, rejected
+
+    def assign_category(self, category):
+        """
+        Adds the category to the news of the queryset with one insert into the through table, without saving each
+        news and sending its post_save signal.
+
+        Returns: number of news in the queryset
+        """
+        queryset = self.prefetch_related(None).order_by()
+        through_model = News.category.through
+        with transaction.atomic():
+            news_ids = list(queryset.values_list('id', flat=True))
+            # news that already have the category are skipped by the unique (news, category) constraint
+            through_model.objects.bulk_create([
+                through_model(news_id=news_id, category_id=category.pk) for news_id in news_ids
+            ], ignore_conflicts=True)
+            News.objects.filter(pk__in=news_ids).update(updated_time=timezone.now())
+        return len(news_ids)
+
+
 class News(models.Model):
     STATUS_VOID = "void"
     STATUS_JUNK = "junk"
@@ -28,6 +89,18 @@ class News(models.Model):
               (STATUS_WORTHLESS, _("Worthless")),
               (STATUS_PUBLISHED, _("Published")))
 
+    PUBLISH_PENDING = "pending"
+    PUBLISH_IN_PROGRESS = "publishing"
+    PUBLISH_DONE = "done"
+    PUBLISH_FAILED = "failed"
+
+    PUBLISH_STATUS = (
+        (PUBLISH_PENDING, _("Pending")),
+        (PUBLISH_IN_PROGRESS, _("Publishing")),
+        (PUBLISH_DONE, _("Done")),
+        (PUBLISH_FAILED, _("Failed")),
+    )
+
     PRIORITY_LOW = "low"
     PRIORITY_MEDIUM = "medium"
     PRIORITY_HIGH = "high"
@@ -41,6 +114,7 @@ class News(models.Model):
     created_time = models.DateTimeField(_('created time'), auto_now_add=True)
     updated_time = models.DateTimeField(_('updated time'), auto_now=True)
 
+    # original data of the news crawled before NewsOriginal, new news keep it empty
     news_data = JSONField(_('news data'), default=dict)
     # news_main = models.TextField(_("news main content"), editable=False)
 
@@ -65,11 +139,49 @@ class News(models.Model):
     category = models.ManyToManyField("Category", verbose_name=_("chapar category"), related_name="news", blank=True)
 
     wp_post_id = models.CharField(_('wordpress post id'), max_length=30, blank=True)
+    # modified time of the wordpress post when it is synced last time, see update_published_news
+    wp_modified = models.DateTimeField(_('wordpress modified time'), null=True, blank=True, editable=False)
+    # state of the publish_news_task of the approved news
+    wp_publish_status = models.CharField(
+        _('wordpress publish status'), choices=PUBLISH_STATUS, max_length=20, blank=True, editable=False
+    )
     direct_link = models.CharField(_('direct link'), max_length=2000, blank=True)
 
+    # normalized title and summary for the admin search, see News.save()
+    search_vector = SearchVectorField(_('search vector'), null=True, editable=False)
+
+    # near-duplicate detection of the crawled news, see dedup.py
+    minhash = ArrayField(models.BigIntegerField(), verbose_name=_('minhash'), null=True, editable=False)
+    lsh_bands = ArrayField(models.BigIntegerField(), verbose_name=_('lsh bands'), null=True, editable=False)
+    duplicate_of = models.ForeignKey(
+        'self', verbose_name=_('duplicate of'), on_delete=models.SET_NULL, related_name='duplicates',
+        blank=True, null=True
+    )
+
+    objects = NewsQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('news')
         verbose_name_plural = _("news")
+        constraints = [
+            # site ids are only unique per news website, crawlers insert with ON CONFLICT DO NOTHING against it
+            models.UniqueConstraint(fields=['news_site', 'news_site_id'], name='news_unique_site_id'),
+        ]
+        indexes = [
+            # crawlers look up the crawled links before fetching them, hash index has no size limit on long urls
+            HashIndex(fields=['direct_link'], name='news_direct_link_hash'),
+            # NewsAdmin.get_queryset filters
+            models.Index(fields=['status'], name='news_status_idx'),
+            models.Index(fields=['editor', 'status'], name='news_editor_status_idx'),
+            # update_published_news filters
+            models.Index(fields=['status', 'updated_time'], name='news_status_updated_idx'),
+            models.Index(fields=['wp_post_id'], name='news_wp_post_id_idx'),
+            models.Index(fields=['wp_modified'], name='news_wp_modified_idx'),
+            GinIndex(fields=['search_vector'], name='news_search_vector_gin'),
+            GinIndex(fields=['lsh_bands'], name='news_lsh_bands_gin'),
+            # changelist ordering and keyset pagination
+            models.Index(fields=['created_time', 'id'], name='news_created_time_id_idx'),
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -78,6 +190,59 @@ class News(models.Model):
     def __str__(self):
         return self.news_title
 
+    def save(self, *args, **kwargs):
+        # keeping the search vector up to date with the title and summary
+        search_fields = {'news_title', 'news_summary'}
+        update_fields = kwargs.get('update_fields')
+        changed = update_fields is None or search_fields & set(update_fields)
+        if changed and not search_fields & self.get_deferred_fields():
+            self.search_vector = news_search_vector(self.news_title, self.news_summary)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'search_vector'}
+        super().save(*args, **kwargs)
+
+    def get_original(self):
+        """
+        Returns: NewsOriginal of the news, for the news crawled before it an unsaved one built from news_data, until
+        tasks.move_news_originals has moved it
+        """
+        try:
+            return self.original
+        except NewsOriginal.DoesNotExist:
+            return self.original_from_news_data()
+
+    def original_from_news_data(self):
+        """
+        Returns: unsaved NewsOriginal built from the news_data of a news crawled before NewsOriginal
+        """
+        return NewsOriginal(
+            news=self,
+            title=self.news_data.get('org_news_title', ''),
+            summary=self.news_data.get('org_news_summary', ''),
+            main=self.news_data.get('org_news_main', ''),
+            image=self.news_data.get('org_news_image', ''),
+            date=self.news_data.get('org_news_date', ''),
+        )
+
+
+class NewsOriginal(models.Model):
+    """
+    Write-once copy of the crawled news, kept out of the News row that is rewritten on every edit and status change.
+    """
+    news = models.OneToOneField(News, on_delete=models.CASCADE, primary_key=True, related_name='original')
+    title = models.CharField(_("title"), max_length=1500)
+    summary = models.TextField(_("news summary"))
+    main = models.TextField(_("news main content"))
+    image = models.CharField(_("image url"), max_length=2000, blank=True)
+    date = models.CharField(_("news date"), max_length=100, blank=True)
+
+    class Meta:
+        verbose_name = _('original news')
+        verbose_name_plural = _("original news")
+
+    def __str__(self):
+        return self.title
+
 
 class Category(models.Model):
     created_time = models.DateTimeField(_('created time'), auto_now_add=True)
@@ -99,9 +264,31 @@ class NewsSiteCategory(models.Model):
     category = models.ForeignKey('Category', on_delete=models.CASCADE, verbose_name=_('category'))
     news_agency = models.ForeignKey('NewsAgency', on_delete=models.CASCADE)
 
+    # crawl schedule of the category page, see schedule_crawls
+    poll_interval = models.PositiveIntegerField(
+        _('poll interval'), default=900, help_text=_("seconds between two crawls, adapted to the new news of the page")
+    )
+    next_crawl_time = models.DateTimeField(_('next crawl time'), null=True, blank=True)
+    # validators of the last crawled listing page, the crawler skips a page that is not changed
+    etag = models.CharField(_('etag'), max_length=255, blank=True, editable=False)
+    last_modified = models.CharField(_('last modified'), max_length=64, blank=True, editable=False)
+    content_hash = models.CharField(_('content hash'), max_length=64, blank=True, editable=False)
+
     def __str__(self):
         return f"{self.category} - {self.site_category_name}"
 
+    def adapt_poll_interval(self, created):
+        """
+        Polls a page that gives new news twice as often and a page without new news 1.5 times less often, within
+        ``settings.CRAWL_MIN_INTERVAL`` and ``settings.CRAWL_MAX_INTERVAL`` seconds.
+
+        Args:
+            created: number of news created by the last crawl of the page
+        """
+        interval = self.poll_interval / 2 if created else self.poll_interval * 1.5
+        self.poll_interval = int(min(max(interval, settings.CRAWL_MIN_INTERVAL), settings.CRAWL_MAX_INTERVAL))
+        self.next_crawl_time = timezone.now() + timedelta(seconds=self.poll_interval)
+
 
 class NewsAgency(models.Model):
     created_time = models.DateTimeField(_('created time'), auto_now_add=True)
@@ -112,6 +299,9 @@ class NewsAgency(models.Model):
 
     news_website = models.CharField(_("news website"), max_length=150)
     crawl_enable = models.BooleanField(_("crawl enable"), default=True)
+    crawl_concurrency = models.PositiveSmallIntegerField(
+        _("crawl concurrency"), default=4, help_text=_("maximum number of simultaneous requests to this website")
+    )
 
     class Meta:
         verbose_name = _('news agency')
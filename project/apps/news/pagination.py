@@ -0,0 +1,33 @@
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimate_count(queryset):
+    """
+    Returns: number of rows of the queryset estimated by the postgres planner, without running it
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator of big tables, a COUNT(*) over millions of rows is replaced by the planner estimate when the estimate
+    is above ``settings.NEWS_EXACT_COUNT_LIMIT``, smaller results are still counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate > settings.NEWS_EXACT_COUNT_LIMIT:
+            return estimate
+        return super().count
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import signals
+from django.dispatch import receiver
+
+user_groups_cache_key = 'news_user_groups_{}'
+
+
+def get_user_groups(request):
+    """
+    Group names of request.user, queried once per request and kept on the request object.
+    They are also cached across requests for ``settings.NEWS_ROLE_CACHE_TIMEOUT`` seconds (0 disables it),
+    the cache is cleared when the groups of the user change.
+
+    Returns: frozenset of group names
+    """
+    user_groups = getattr(request, '_news_user_groups', None)
+    if user_groups is None:
+        key = user_groups_cache_key.format(request.user.pk)
+        timeout = settings.NEWS_ROLE_CACHE_TIMEOUT
+        user_groups = cache.get(key) if timeout else None
+        if user_groups is None:
+            user_groups = frozenset(request.user.groups.values_list('name', flat=True))
+            if timeout:
+                cache.set(key, user_groups, timeout)
+        request._news_user_groups = user_groups
+    return user_groups
+
+
+@receiver(signals.m2m_changed, sender=User.groups.through)
+def clear_user_groups_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        user_ids = pk_set if reverse else [instance.pk]
+    elif action == 'pre_clear' and reverse:
+        # group.user_set.clear() does not send the ids of the removed users
+        user_ids = list(instance.user_set.values_list('pk', flat=True))
+    elif action == 'post_clear' and not reverse:
+        user_ids = [instance.pk]
+    else:
+        return
+    cache.delete_many([user_groups_cache_key.format(user_id) for user_id in user_ids])
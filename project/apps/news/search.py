@@ -0,0 +1,43 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db.models import TextField, Value
+
+# postgres has no persian text search configuration, texts are normalized here and indexed with "simple"
+SEARCH_CONFIG = 'simple'
+
+persian_translation = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه', 'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا', 'ؤ': 'و',
+    '\u200c': ' ',  # zero width non-joiner
+    **{persian: str(digit) for digit, persian in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+    **{arabic: str(digit) for digit, arabic in enumerate('٠١٢٣٤٥٦٧٨٩')},
+})
+# harakat, superscript alef and tatweel
+diacritics_re = re.compile('[\u064b-\u065f\u0670\u0640]')
+word_re = re.compile(r'\w+')
+
+
+def normalize(text):
+    """
+    Unifies the arabic and persian forms of letters and digits, drops diacritics and splits the words joined with
+    zero width non-joiner.
+    """
+    return diacritics_re.sub('', (text or '').translate(persian_translation)).lower()
+
+
+def news_search_vector(title, summary):
+    return (
+        SearchVector(Value(normalize(title), output_field=TextField()), config=SEARCH_CONFIG, weight='A') +
+        SearchVector(Value(normalize(summary), output_field=TextField()), config=SEARCH_CONFIG, weight='B')
+    )
+
+
+def news_search_query(search_term):
+    """
+    Returns: SearchQuery matching the news that have all the words of the search term as a word prefix,
+    None if the term has no words
+    """
+    words = word_re.findall(normalize(search_term))
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), config=SEARCH_CONFIG, search_type='raw')
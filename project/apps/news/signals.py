@@ -1,12 +1,13 @@
-from django.db import models
+from django.db import models, transaction
 from django.dispatch import receiver
 
 import requests
 from bs4 import BeautifulSoup
 from khayyam import JalaliDate
 
+from .extractors import Extractor, Selector
 from .models import News
-from .utils import WordPressHandler
+from .tasks import publish_news_task
 
 jalali_months = ["فروردین", "اردیبهشت", "خرداد", "تیر", "مرداد", "شهریور", "مهر", "آبان", "آذر", "دی", "بهمن", "اسفند"]
 
@@ -36,15 +37,40 @@ jalali_months = ["فروردین", "اردیبهشت", "خرداد", "تیر", "
 #         instance.number_of_changes = number_of_changes
 
 
+tasnim_extractor = Extractor({
+    'jalali_date': Selector("li", class_="time", get='text'),
+    'news_category': Selector("li", class_="service", index=None, get='text'),
+    'news_title': Selector("h1", class_="title", get='text'),
+    'news_main': Selector("div", class_="story", many="p", get='html'),
+    'news_summary': Selector("h3", class_="lead"),
+    'news_image': Selector("img", class_="img-responsive", get='@src'),
+})
+
+sputnik_extractor = Extractor({
+    'news_category': Selector("a", class_="b-article__refs-rubric", get='text'),
+    'news_title': Selector("div", class_="b-article__header-title", find="h1", get='text'),
+    'news_main': Selector("div", class_="b-article__text", many="p", get='html'),
+    'news_summary': Selector("div", class_="b-article__lead", find="p"),
+    'news_image': Selector("div", class_="b-article__header", find="img", get='@src'),
+})
+
+yjc_extractor = Extractor({
+    'news_site_id': Selector("div", class_="news_nav news_id_c", get='strip'),
+    'news_jalali_date': Selector("div", class_="news_nav news_pdate_c", get='text'),
+    'news_category': Selector("div", class_="news_path", find="a", get='strip'),
+    'news_title': Selector("div", class_="title", find="a", get='strip'),
+    'news_main': Selector("div", class_="body", many="p", get='html'),
+    'news_summary': Selector("h2", class_="Htags_news_subtitle", get='strip'),
+    'news_image': Selector("div", class_="body", find="img", get='@src'),
+})
+
+
 def collect_tasnim_news():
     url = "https://www.tasnimnews.com/fa/news/1399/07/08/2359191/%D9%88%D8%B2%D8%A7%D8%B1%D8%AA-%D8%A7%D9%85%D9%88%D8%B1-%D8%AE%D8%A7%D8%B1%D8%AC%D9%87-%D8%AA%D8%B1%D8%A7%D9%86%D8%B2%DB%8C%D8%AA-%D8%AA%D8%B3%D9%84%DB%8C%D8%AD%D8%A7%D8%AA-%D8%A7%D8%B2-%D8%AE%D8%A7%DA%A9-%D8%A7%DB%8C%D8%B1%D8%A7%D9%86-%D8%A8%D9%87-%D8%A7%D8%B1%D9%85%D9%86%D8%B3%D8%AA%D8%A7%D9%86-%D8%B1%D8%A7-%D8%B1%D8%AF-%DA%A9%D8%B1%D8%AF"
     page = requests.get(url)
-    soup = BeautifulSoup(page.text, 'html.parser')
-
-    jalali_date = soup.find("li", class_="time").get_text()
-    # print(jalali_date)
+    data = tasnim_extractor.extract(BeautifulSoup(page.text, 'html.parser'))
 
-    jalali_date_details = jalali_date.split("-")
+    jalali_date_details = data['jalali_date'].split("-")
     jalali_date_details = jalali_date_details[0].strip().split(" ")
     # print(jalali_date_details)
     news_date = JalaliDate(int(jalali_date_details[2]),
@@ -53,54 +79,24 @@ def collect_tasnim_news():
 
     # print(news_date)
 
-    news_category_list = soup.find_all("li", class_="service")
-    news_category = ""
-    for li in news_category_list:
-        news_category += li.get_text()
-
+    news_category = "".join(data['news_category'])
     # print(news_category)
 
-    news_title = soup.find("h1", class_="title").get_text()
-    # print(news_title)
-
-    news_main_list = soup.find("div", class_="story").find_all("p")
-    news_main = ""
-    for p in news_main_list:
-        if "</a>" not in str(p):
-            news_main += str(p)
-
+    news_main = "".join(p for p in data['news_main'] if "</a>" not in p)
     # print(news_main)
 
-    news_summary = soup.find("h3", class_="lead")
-    # print(news_summary)
-
-    news_image = soup.find("img", class_="img-responsive").attrs['src']
-    print(news_image)
+    print(data['news_image'])
 
 
 def collect_sputnik_news():
     url = "https://ir.sputniknews.com/near_east/202009296979453-%D8%A8%D8%A7%D8%B2%D8%AF%D8%A7%D8%B4%D8%AA-%D9%85%D8%B8%D9%86%D9%88%D9%86%DB%8C%D9%86-%D8%B9%D9%85%D9%84%DB%8C%D8%A7%D8%AA-%D8%AA%D8%B1%D9%88%D8%B1%DB%8C%D8%B3%D8%AA%DB%8C-%D8%AF%D8%B1-%D8%B9%D8%B1%D8%A8%D8%B3%D8%AA%D8%A7%D9%86"
     page = requests.get(url)
-    soup = BeautifulSoup(page.text, "html.parser")
-
-    news_category = soup.find("a", class_="b-article__refs-rubric").get_text()
-    # print(news_category)
-
-    news_title = soup.find("div", class_="b-article__header-title").find("h1").get_text()
-    # print(news_title)
+    data = sputnik_extractor.extract(BeautifulSoup(page.text, "html.parser"))
 
-    news_main_list = soup.find("div", class_="b-article__text").find_all("p")
-
-    news_main = str()
-    for p in news_main_list:
-        news_main += str(p)
+    news_main = "".join(data['news_main'])
     # print(news_main)
 
-    news_summary = soup.find("div", class_="b-article__lead").find("p")
-    # print(news_summary)
-
-    news_image = soup.find("div", class_="b-article__header").find("img").attrs["src"]
-    print(news_image)
+    print(data['news_image'])
 
 
 def collect_yjc_news():
@@ -108,42 +104,30 @@ def collect_yjc_news():
           "%D8%A8%D8%AA-%D9%86%D8%A7%D9%85-%D9%88%D8%A7%D9%85-%D9%88%D8%AF%DB%8C%D8%B9%D9%87-%D9%85%D8%B3%DA%A9%D9%86" \
           "-%D8%AA%D8%A7-%D8%B3%D8%A7%D8%B9%D8%A7%D8%AA%DB%8C-%D8%AF%DB%8C%DA%AF%D8%B1 "
     page = requests.get(url)
-    soup = BeautifulSoup(page.text, "html.parser")
+    data = yjc_extractor.extract(BeautifulSoup(page.text, "html.parser"))
 
-    news_site_id = int(soup.find("div", class_="news_nav news_id_c").get_text().strip().split(' ')[-1])
+    news_site_id = int(data['news_site_id'].split(' ')[-1])
     # print(news_site_id)
 
-    news_jalali_date = soup.find("div", class_="news_nav news_pdate_c").get_text().split("-")[0].split(":")[1].strip()
+    news_jalali_date = data['news_jalali_date'].split("-")[0].split(":")[1].strip()
     # print(news_jalali_date)
 
-    news_category = soup.find("div", class_="news_path").find("a").get_text().strip()
-    # print(news_category)
-
-    news_title = soup.find("div", class_="title").find("a").get_text().strip()
-    # print(news_title)
-
-    news_main_list = soup.find("div", class_="body").find_all("p")
-
-    news_main = str()
-    for p in news_main_list:
-        news_main += str(p)
-
+    news_main = "".join(data['news_main'])
     # print(news_main)
 
-    news_summary = soup.find("h2", class_="Htags_news_subtitle").get_text().strip()
-    # print(news_summary)
-
     news_date_list = news_jalali_date.split(" ")
     news_date = JalaliDate(int(news_date_list[2]), jalali_months.index(news_date_list[1]) + 1, int(news_date_list[0]))\
         .todate()
     # print(news_date)
 
-    news_image = soup.find("div", class_="body").find("img").attrs["src"]
-    # print(news_image)
-
 
 @receiver(models.signals.post_save, sender=News)
 def create_word_press_post(sender, instance, **kwargs):
-    if instance._b_status != News.STATUS_APPROVED and instance.status == News.STATUS_APPROVED:
-        WordPressHandler(instance).create_post()
+    # publishing runs on the celery workers, the approval request only queues it
+    if instance._b_status != News.STATUS_APPROVED and instance.status == News.STATUS_APPROVED \
+            and not instance.wp_post_id:
+        News.objects.filter(pk=instance.pk).update(wp_publish_status=News.PUBLISH_PENDING)
+        instance.wp_publish_status = News.PUBLISH_PENDING
+        transaction.on_commit(lambda: publish_news_task.delay(instance.pk))
+    instance._b_status = instance.status
 
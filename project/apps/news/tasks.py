@@ -1,24 +1,214 @@
+import logging
 from datetime import timedelta
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Q
 from django.utils import timezone
-from celery import shared_task
+from celery import group, shared_task
 
-from .utils import CrawlerDynamically, WordPressHandler
-from .models import News
+import requests
+
+from .images import create_variants
+from .search import news_search_vector
+from .utils import CrawlerDynamically, WordPressError, WordPressHandler
+from .models import News, NewsOriginal, NewsSiteCategory
+
+logger = logging.getLogger(__file__)
 
 
 @shared_task
 def collect_news_task(website_name):
-    # Crawling the news website by get dynamically it
-    CrawlerDynamically(website_name)()
+    # Crawling all the category pages of the news website now, each by its own task
+    for site_category_id in NewsSiteCategory.objects.filter(
+        news_agency__slug=website_name
+    ).values_list('id', flat=True):
+        crawl_category_task.delay(site_category_id)
+
+
+@shared_task
+def schedule_crawls():
+    """
+    Queues the crawl of the category pages whose poll interval is passed, the crawl task sets the next crawl time.
+    """
+    now = timezone.now()
+    due = NewsSiteCategory.objects.filter(
+        Q(next_crawl_time__isnull=True) | Q(next_crawl_time__lte=now), news_agency__crawl_enable=True
+    )
+    site_category_ids = list(due.values_list('id', flat=True))
+    # not queued again by the next ticks while it waits for its website lock
+    NewsSiteCategory.objects.filter(pk__in=site_category_ids).update(
+        next_crawl_time=now + timedelta(seconds=settings.CRAWL_LOCK_TIMEOUT)
+    )
+    for site_category_id in site_category_ids:
+        crawl_category_task.delay(site_category_id)
+
+
+@shared_task(bind=True)
+def crawl_category_task(self, site_category_id):
+    """
+    Crawls one category page. Crawls of a website never overlap: the task waits for the lock of the website, which
+    is kept ``settings.CRAWL_POLITENESS_DELAY`` seconds after the crawl to space out the requests to the website.
+    """
+    site_category = NewsSiteCategory.objects.select_related('news_agency').filter(pk=site_category_id).first()
+    if site_category is None:
+        return
+    news_agency = site_category.news_agency
+
+    lock_key = f'crawl_lock_{news_agency.news_website}'
+    if not cache.add(lock_key, self.request.id, settings.CRAWL_LOCK_TIMEOUT):
+        if self.request.retries >= settings.CRAWL_LOCK_RETRIES:
+            logger.warning(f'[crawl skipped, website is locked]-[site category: {site_category_id}]')
+            return
+        raise self.retry(countdown=settings.CRAWL_POLITENESS_DELAY, max_retries=settings.CRAWL_LOCK_RETRIES)
+
+    created = 0
+    try:
+        created = CrawlerDynamically(news_agency.slug)(category_ids=[site_category_id]).created
+    finally:
+        cache.set(lock_key, self.request.id, settings.CRAWL_POLITENESS_DELAY)
+        site_category.adapt_poll_interval(created)
+        NewsSiteCategory.objects.filter(pk=site_category_id).update(
+            poll_interval=site_category.poll_interval, next_crawl_time=site_category.next_crawl_time
+        )
+
+
+def dispatch_chunks(queryset, task, chunk_size):
+    """
+    Pages the ids of the queryset with a keyset cursor and runs the task over each chunk of ids as a celery group,
+    so the chunks are processed in parallel by all the workers and a failed chunk is retried alone.
+
+    Args:
+        queryset: rows to process
+        task: celery task that takes a list of ids
+        chunk_size: number of ids of each subtask
+
+    Returns: number of dispatched chunks
+    """
+    chunks = []
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            break
+        chunks.append(task.s(ids))
+        last_id = ids[-1]
+    if chunks:
+        group(chunks).apply_async()
+    return len(chunks)
+
+
+@shared_task
+def update_published_news(chunk_size=100):
+    """
+    Syncs the approved news with the edits of their wordpress posts. Only the news of the posts modified after the
+    last synced post are synced, all the approved news are synced only on the first run.
+    """
+    news_list = News.objects.filter(status=News.STATUS_APPROVED).exclude(wp_post_id='')
+
+    cursor = News.objects.aggregate(cursor=Max('wp_modified'))['cursor']
+    if cursor is not None:
+        modified_after = (cursor - timedelta(hours=settings.WP_SYNC_OVERLAP)).isoformat()
+        news_list = news_list.filter(wp_post_id__in=[
+            str(post['id']) for post in WordPressHandler(None).get_posts(modified_after=modified_after, _fields='id')
+        ])
+    dispatch_chunks(news_list, sync_published_news_chunk, chunk_size)
+
+
+@shared_task(
+    autoretry_for=(requests.RequestException, WordPressError), retry_backoff=settings.WP_PUBLISH_RETRY_DELAY,
+    max_retries=settings.WP_PUBLISH_MAX_RETRIES
+)
+def sync_published_news_chunk(news_ids):
+    """
+    Syncs a chunk of the approved news with their wordpress posts requested at once, the changed news are written
+    with one bulk_update. News that are already synced are skipped, so a retried chunk does not write them again.
+    """
+    news_by_post_id = {
+        news.wp_post_id: news
+        for news in News.objects.for_sync().filter(pk__in=news_ids, status=News.STATUS_APPROVED).exclude(wp_post_id='')
+    }
+    if not news_by_post_id:
+        return
+
+    changed = []
+    for post in WordPressHandler(None).get_posts(include=','.join(news_by_post_id)):
+        news = news_by_post_id.get(str(post['id']))
+        if news is not None and WordPressHandler(news).update_news_from_post(post):
+            changed.append(news)
+    News.objects.bulk_update(
+        changed, ['updated_time', 'number_of_changes', 'news_main_editable', 'status', 'wp_modified']
+    )
+
+
+@shared_task(bind=True, max_retries=settings.WP_PUBLISH_MAX_RETRIES, acks_late=True)
+def publish_news_task(self, news_id):
+    """
+    Creates the wordpress post of an approved news, queued by the post_save signal instead of publishing inside the
+    admin request. The task is idempotent: a news that already has a wp_post_id is never posted again, and a cache
+    lock keeps two workers from posting the same news at once.
+    """
+    lock_key = f'news_publish_lock_{news_id}'
+    if not cache.add(lock_key, self.request.id, settings.WP_PUBLISH_LOCK_TIMEOUT):
+        # another worker is publishing it, or a dead worker's lock is still live and this is its redelivered message,
+        # returning would ack it and leave the news publishing forever
+        raise self.retry(countdown=settings.WP_PUBLISH_LOCK_TIMEOUT)
+
+    try:
+        news = News.objects.filter(pk=news_id, status=News.STATUS_APPROVED, wp_post_id='').first()
+        if news is None:
+            return
+        News.objects.filter(pk=news_id).update(wp_publish_status=News.PUBLISH_IN_PROGRESS)
+        WordPressHandler(news).create_post()
+    except (requests.RequestException, WordPressError) as e:
+        retries_left = self.request.retries < self.max_retries
+        News.objects.filter(pk=news_id).update(
+            wp_publish_status=News.PUBLISH_PENDING if retries_left else News.PUBLISH_FAILED
+        )
+        raise self.retry(exc=e, countdown=settings.WP_PUBLISH_RETRY_DELAY * 2 ** self.request.retries)
+    except Exception:
+        # not a network or api error, retrying would fail the same way
+        News.objects.filter(pk=news_id).update(wp_publish_status=News.PUBLISH_FAILED)
+        logger.exception(f'[publishing news failed]-[news: {news_id}]')
+        raise
+    finally:
+        cache.delete(lock_key)
+
+
+@shared_task
+def create_image_variants_task(name):
+    # Creating the publish and thumbnail variants of a downloaded news image
+    create_variants(name)
+
+
+@shared_task
+def update_search_vectors(chunk_size=500):
+    # Filling the search vector of the news saved before the full text search
+    dispatch_chunks(News.objects.filter(search_vector__isnull=True), update_search_vectors_chunk, chunk_size)
+
+
+@shared_task
+def update_search_vectors_chunk(news_ids):
+    news_list = list(News.objects.filter(pk__in=news_ids).only('id', 'status', 'news_title', 'news_summary'))
+    for news in news_list:
+        news.search_vector = news_search_vector(news.news_title, news.news_summary)
+    News.objects.bulk_update(news_list, ['search_vector'])
+
+
+@shared_task
+def move_news_originals(chunk_size=500):
+    # Moving the original of the news crawled before NewsOriginal out of news_data, which is read with the news row
+    dispatch_chunks(
+        News.objects.filter(original__isnull=True).exclude(news_data={}), move_news_originals_chunk, chunk_size
+    )
 
 
 @shared_task
-def update_published_news():
-    for news in News.objects.filter(
-        updated_time__lte=timezone.now() - timedelta(hours=72),
-        status=News.STATUS_APPROVED
-    ).exclude(
-        wp_post_id=''
-    ):
-        WordPressHandler(news).update_news_from_post()
+def move_news_originals_chunk(news_ids):
+    with transaction.atomic():
+        news_list = News.objects.filter(pk__in=news_ids, original__isnull=True).only('id', 'status', 'news_data')
+        NewsOriginal.objects.bulk_create(
+            [news.original_from_news_data() for news in news_list], ignore_conflicts=True
+        )
+        News.objects.filter(pk__in=news_ids, original__isnull=False).exclude(news_data={}).update(news_data={})
@@ -1,18 +1,72 @@
+import base64
 import json
+import mimetypes
 import random
 import os
-import difflib
+import threading
+import time
 from importlib import import_module
 import logging
 
 from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.core.cache import cache
+from django.core.files.storage import default_storage
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .changes import count_changes
 
 logger = logging.getLogger(__file__)
 
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+
+class HttpSession(requests.Session):
+    """
+    requests Session that applies ``settings.HTTP_TIMEOUT`` to every request which does not pass its own timeout.
+    """
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', settings.HTTP_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
+def get_http_session():
+    """
+    Shared keep-alive session for crawlers and WordPressHandler, connections to each host are pooled and reused
+    instead of opening a new TCP+TLS connection per request.
+    Idempotent requests are retried with exponential backoff on connection errors and 5xx/429 responses.
+
+    The session is created lazily per process, so celery prefork children never share the parent's sockets.
+
+    Returns: HttpSession
+    """
+    global _http_session, _http_session_pid
+    with _http_session_lock:
+        if _http_session is None or _http_session_pid != os.getpid():
+            retry = Retry(
+                total=settings.HTTP_MAX_RETRIES,
+                backoff_factor=settings.HTTP_BACKOFF_FACTOR,
+                status_forcelist=(429, 500, 502, 503, 504),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                max_retries=retry,
+            )
+            session = HttpSession()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session, _http_session_pid = session, os.getpid()
+        return _http_session
+
 
 def CrawlerDynamically(class_name):
     """
@@ -25,64 +79,163 @@ def CrawlerDynamically(class_name):
     return getattr(module, f'{class_name.upper()}Crawler')
 
 
-class WordPressHandler:
-    token_cache_key = 'wordpress_auth_token'
+class WordPressError(Exception):
+    """
+    Unsuccessful response of the wordpress api
+    """
+
+
+class WordPressTokenManager:
+    """
+    JWT token of the wordpress api shared by all the handlers of all the workers through the cache.
+
+    The expiry is read from the token itself, so a valid token is used without any validation request. It is
+    refreshed ``settings.WP_TOKEN_REFRESH_MARGIN`` seconds before it expires, by one worker at a time, the others
+    keep using the current token meanwhile. The token is validated with wordpress only when a request gets 401.
+    """
+    cache_key = 'wordpress_auth_token'
+    lock_key = 'wordpress_auth_token_lock'
     base_url = 'https://www.chapar.news/wp-json/'
     urls = {
         'token': 'jwt-auth/v1/token',
         'validate-token': 'jwt-auth/v1/token/validate',
-        'post': f'wp/v2/posts/',
-        'media': f'wp/v2/media/'
     }
 
-    def __init__(self, instance):
+    def __init__(self):
+        self._token = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def expires_in(token):
         """
-        Args:
-            instance: Instance is News object.
+        Returns: seconds until the expiry in the token payload, None if the token has no readable expiry
         """
-        self.instance = instance
-        self.token = cache.get(self.token_cache_key) or self.get_token()
-        self.validate_token()
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            return int(json.loads(base64.urlsafe_b64decode(payload))['exp']) - time.time()
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            return None
 
-    # def get_headers(self):
-    # return dict(Authorization=f"Bearer {settings.WORDPRESS_TOKEN}")
-    # return dict(Authorization="Basic %s" % b64encode('m.rezaei:09VqT4X1dxJOwB'))
+    def is_fresh(self, token, margin=None):
+        if not token:
+            return False
+        expires_in = self.expires_in(token)
+        # a token without expiry is used until wordpress rejects it
+        return expires_in is None or expires_in > (settings.WP_TOKEN_REFRESH_MARGIN if margin is None else margin)
 
     def get_token(self):
-        logger.debug(f"[getting new token]-[URL: {self.urls['token']}]")
-        req = self.post_request(
-            self.urls['token'],
-            auth=False,
-            json=dict(username=settings.WP_USER, password=settings.WP_PASS),
-        )
+        with self._lock:
+            token = self._token
+            if not self.is_fresh(token):
+                token = cache.get(self.cache_key)
+            if not self.is_fresh(token):
+                token = self.refresh(token)
+            self._token = token
+            return token
 
-        if req.ok:
+    def refresh(self, current=None):
+        """
+        Gets a new token, only the worker that takes the lock requests it. The others keep the current token while
+        it is not expired, or wait for the new one.
+
+        Returns: new token, None if wordpress does not give one
+        """
+        lock_timeout = settings.HTTP_TIMEOUT * (settings.HTTP_MAX_RETRIES + 1)
+        deadline = time.time() + lock_timeout
+        locked = cache.add(self.lock_key, os.getpid(), lock_timeout)
+        while not locked and time.time() < deadline:
+            if self.is_fresh(current, margin=0):
+                return current
+            time.sleep(0.2)
+            token = cache.get(self.cache_key)
+            if token and token != current:
+                return token
+            locked = cache.add(self.lock_key, os.getpid(), lock_timeout)
+
+        try:
+            logger.debug(f"[getting new token]-[URL: {self.urls['token']}]")
+            req = get_http_session().post(
+                self.base_url + self.urls['token'],
+                json=dict(username=settings.WP_USER, password=settings.WP_PASS),
+            )
+            if not req.ok:
+                logger.critical(f'[Getting token failed]-[status: {req.status_code}]')
+                return None
             token = req.json()['data']['token']
-            logger.debug(f'[new token successfully added]-[token: {token}]')
-            cache.set(self.token_cache_key, token, 604800)  # 7 days default expire time
+            logger.debug(f'[new token successfully added]')
+            expires_in = self.expires_in(token)
+            cache.set(self.cache_key, token, 604800 if expires_in is None else max(int(expires_in), 1))  # 7 days
             return token
-        else:
-            logger.critical(f'[Getting token failed]-[]')
+        finally:
+            if locked:
+                cache.delete(self.lock_key)
+
+    def handle_unauthorized(self, token):
+        """
+        Validates a token that got 401 and replaces it if wordpress does not accept it.
 
-    def validate_token(self):
+        Returns: token to retry the request with
+        """
         logger.debug(f"[validating the JWT Token]-[URL: {self.urls['validate-token']}]")
-        req = self.post_request(
-            self.urls['validate-token'],
-            auth=True,
+        req = get_http_session().post(
+            self.base_url + self.urls['validate-token'], headers={'Authorization': f"Bearer {token}"}
         )
         if req.ok:
             logger.debug(f'[Token is valid]')
-        else:
-            logger.debug(f'[JWT Token of WP is not valid or expired]')
-            self.token = self.get_token()
+            return token
+
+        logger.debug(f'[JWT Token of WP is not valid or expired]')
+        with self._lock:
+            self._token = None
+        if cache.get(self.cache_key) == token:
+            cache.delete(self.cache_key)
+        return self.get_token()
+
 
-    def post_request(self, url, method='post', headers={}, auth=True, **kwargs):
+wordpress_tokens = WordPressTokenManager()
+
+
+class WordPressHandler:
+    base_url = 'https://www.chapar.news/wp-json/'
+    urls = {
+        'post': f'wp/v2/posts/',
+        'media': f'wp/v2/media/'
+    }
+
+    def __init__(self, instance):
+        """
+        Args:
+            instance: Instance is News object.
+        """
+        self.instance = instance
+
+    # def get_headers(self):
+    # return dict(Authorization=f"Bearer {settings.WORDPRESS_TOKEN}")
+    # return dict(Authorization="Basic %s" % b64encode('m.rezaei:09VqT4X1dxJOwB'))
+
+    def post_request(self, url, method='post', headers=None, auth=True, **kwargs):
+        headers = dict(headers or {})
+        token = wordpress_tokens.get_token() if auth else None
         if auth:
-            headers.update({'Authorization': f"Bearer {self.token}"})
+            headers.update({'Authorization': f"Bearer {token}"})
 
         if headers:
             kwargs.update({'headers': headers})
-        return requests.request(
+        req = self.send(method, url, **kwargs)
+
+        if auth and req.status_code == 401:
+            new_token = wordpress_tokens.handle_unauthorized(token)
+            if new_token and new_token != token:
+                headers.update({'Authorization': f"Bearer {new_token}"})
+                # the uploaded files are read again
+                for file in (kwargs.get('files') or {}).values():
+                    file[1].seek(0)
+                req = self.send(method, url, **kwargs)
+        return req
+
+    def send(self, method, url, **kwargs):
+        return get_http_session().request(
             method,
             f"{self.base_url + url}",
             # auth=HTTPBasicAuth(settings.WP_USER, settings.WP_PASS),
@@ -92,7 +245,7 @@ class WordPressHandler:
     def create_post(self):
         """
         Create a new Post to Wordpress from News object.
-        Returns: None
+        Raises: WordPressError if wordpress does not create the post
         """
         media_id = self.create_media()  # Create media for this post
         categories = self.instance.category.all()
@@ -111,12 +264,14 @@ class WordPressHandler:
             featured_media=media_id,
         )
         req = self.post_request(self.urls['post'], json=payload_data, headers={'Content-Type': 'application/json'})
-        if req.ok:
-            from project.apps import News
+        if not req.ok:
+            raise WordPressError(f'creating post failed, status: {req.status_code}, news: {self.instance.pk}')
 
-            self.instance.wp_post_id = req.json()['id']
-            self.instance._b_status = News.STATUS_APPROVED
-            self.instance.save()
+        from .models import News
+        self.instance.wp_post_id = req.json()['id']
+        self.instance.wp_publish_status = News.PUBLISH_DONE
+        self.instance._b_status = self.instance.status
+        self.instance.save(update_fields=['updated_time', 'wp_post_id', 'wp_publish_status'])
 
     def create_media(self):
         """
@@ -124,36 +279,99 @@ class WordPressHandler:
 
         Returns: media's id of uploaded image to wordpress site
         """
-        file_name = self.instance.news_image.name.split('/')[-1]
+        from .images import create_variant
+
+        if not self.instance.news_image:
+            return None
+        # uploading the web optimized variant instead of the full resolution original
+        image_name = self.instance.news_image.name
+        try:
+            image_name, content_type = create_variant(image_name, 'publish'), 'image/jpeg'
+        except Exception as e:
+            # an image Pillow cannot decode (svg, truncated file, ...) is uploaded as it is
+            logger.error(f'[creating publish variant failed]-[image: {image_name}, error: {e.args}]')
+            content_type = mimetypes.guess_type(image_name)[0] or 'application/octet-stream'
+        file_name = image_name.split('/')[-1]
         payload_data = dict(status='draft')
         req = self.post_request(
             self.urls['media'],
             data={'file': file_name, 'data': json.dumps(payload_data)},
             files={'file': (
                 file_name,
-                open(self.instance.news_image.path, 'rb'),
-                f'image/{file_name.split(".")[-1]}',
+                default_storage.open(image_name, 'rb'),
+                content_type,
                 {'Expires': '0'}
             )},
         )
         if req.ok:
             return req.json()['id']
 
-    def update_news_from_post(self):
+    def get_posts(self, **params):
+        """
+        Yields the posts of wp/v2/posts matching the params, requested page by page in the edit context that has the
+        raw content.
+
+        Args:
+            params: filters of the posts endpoint, e.g. include="1,2,3" or modified_after="2020-09-01T00:00:00"
+        """
+        params = {
+            'context': 'edit', 'status': 'any', 'per_page': 100, 'orderby': 'modified', 'order': 'asc',
+            '_fields': 'id,status,modified_gmt,content', **params
+        }
+        page = 1
+        while True:
+            req = self.post_request(self.urls['post'], method='get', params={**params, 'page': page})
+            if not req.ok:
+                raise WordPressError(f'getting posts failed, status: {req.status_code}, page: {page}')
+            yield from req.json()
+            if page >= int(req.headers.get('X-WP-TotalPages') or 1):
+                break
+            page += 1
+
+    def update_news_from_post(self, post):
+        """
+        Copies the content and the status of the wordpress post to the news without saving it.
+
+        Args:
+            post: the post of the news returned by get_posts()
+
+        Returns: True if the post is modified since the last sync of the news
+        """
         from .models import News
-        req = self.post_request(f"{self.urls['post'] + self.instance.wp_post_id}",
-                                headers={'Content-Type': 'application/json'})
-        if req.ok:
-            changes = 0
-            for s in difflib.ndiff(self.instance.news_main, req.json()['content']['raw']):
-                if s[0] == "+" or s[0] == "-":
-                    changes += 1
-
-            self.instance.number_of_changes = changes
-            self.instance.news_main_editable = req.json()['content']['raw']
-            if req.json()['status'] == 'publish':
-                self.instance.status = News.STATUS_PUBLISHED
-            self.instance.save(update_fields=['updated_time', 'number_of_changes', 'news_main_editable', 'status'])
+
+        modified = timezone.make_aware(parse_datetime(post['modified_gmt']), timezone.utc)
+        if self.instance.wp_modified == modified:
+            return False
+
+        self.instance.number_of_changes = count_changes(self.instance.get_original().main, post['content']['raw'])
+        self.instance.news_main_editable = post['content']['raw']
+        if post['status'] == 'publish':
+            self.instance.status = News.STATUS_PUBLISHED
+        self.instance.wp_modified = modified
+        self.instance.updated_time = timezone.now()
+        return True
+
+
+def save_content_addressed(file, digest, extension, storage=default_storage):
+    """
+    Stores the file under a name made of its content hash, an identical file (e.g. the same agency photo used in
+    many news) is stored once and its existing name is reused.
+
+    Args:
+        file: <django.core.files.File> to store
+        digest: hex digest of the file content
+        extension: file extension with the leading dot
+
+    Returns: name of the stored file
+    """
+    name = f'images/News/{digest[:2]}/{digest}{extension}'
+    if storage.exists(name):
+        return name
+    stored = storage.save(name, file)
+    if stored != name:
+        # another thread stored the same content between exists() and save(), the storage renamed this copy
+        storage.delete(stored)
+    return name
 
 
 class UploadTo:
@@ -0,0 +1,81 @@
+"""
+Times count_changes on synthetic Persian articles of 5k to 50k characters with a share of their tokens edited,
+optionally against the character-level difflib.ndiff count it replaced.
+
+    cd project && python benchmarks/count_changes.py [--ndiff]
+"""
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conf.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from apps.news.changes import count_changes  # noqa: E402
+
+words = ["خبر", "ایران", "امروز", "مجلس", "گفت", "وزیر", "اقتصاد", "کشور", "شد", "است"]
+
+
+def article(rng, size):
+    """
+    Returns: text of about size characters, words with numbers and some <p> tags
+    """
+    tokens, length = [], 0
+    while length < size:
+        token = '<p>' if rng.random() < 0.02 else f'{rng.choice(words)}{rng.randint(0, 50)}'
+        tokens.append(token)
+        length += len(token) + 1
+    return ' '.join(tokens)
+
+
+def edit(rng, text, share):
+    """
+    Returns: text with a share of its tokens replaced, a new article if share is 1
+    """
+    if share >= 1:
+        return article(rng, len(text))
+    tokens = text.split(' ')
+    for _ in range(int(len(tokens) * share)):
+        tokens[rng.randrange(len(tokens))] = 'ویرایش'
+    return ' '.join(tokens)
+
+
+def ndiff_changes(old_text, new_text):
+    return len([li for li in difflib.ndiff(old_text, new_text) if li[0] != ' '])
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ndiff', action='store_true', help='also time difflib.ndiff, takes minutes')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'chars':>6}{'edited':>8}{'changes':>9}{'ms':>10}" + (f"{'ndiff ms':>12}" if args.ndiff else ''))
+    for size in (5000, 20000, 50000):
+        old_text = article(rng, size)
+        for share in (0.01, 0.05, 0.3, 1):
+            new_text = edit(rng, old_text, share)
+            changes, ms = timed(count_changes, old_text, new_text)
+            line = f'{size:>6}{share:>8.0%}{changes:>9}{ms:>10.1f}'
+            if args.ndiff:
+                line += f'{timed(ndiff_changes, old_text, new_text)[1]:>12.1f}'
+            print(line, flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Times parsing of the saved pages in apps/news/fixtures/pages with each tree builder, with and without the
+SoupStrainers of the crawlers.
+
+    cd project && python benchmarks/parse_pages.py [--number 200]
+"""
+import argparse
+import os
+import sys
+import timeit
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conf.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import override_settings  # noqa: E402
+
+from apps.news.crawler import ENTEKHABCrawler, ILNACrawler, ISNACrawler, make_soup  # noqa: E402
+
+pages_dir = Path(__file__).resolve().parent.parent / 'apps' / 'news' / 'fixtures' / 'pages'
+crawlers = (
+    (ILNACrawler, 'ilna', 'https://www.ilna.news/fa/news/963123/'),
+    (ISNACrawler, 'isna', 'https://www.isna.ir/news/99062215432/'),
+    (ENTEKHABCrawler, 'entekhab', 'https://www.entekhab.ir/fa/news/583412/'),
+)
+
+
+def get_crawler(crawler_class):
+    crawler = crawler_class.__new__(crawler_class)
+    crawler.urls = [{'id': 1, 'news_url': 'https://example.com/', 'category_id': 1, 'site_category_name': ''}]
+    crawler.fetched_listings = {}
+    crawler.listing_states = {}
+    return crawler
+
+
+def news_page(crawler_class, page, url, parse_only):
+    crawler_class.parse_news(get_crawler(crawler_class), url, make_soup(page, parse_only))
+
+
+def listing_page(crawler_class, page, parse_only):
+    crawler = get_crawler(crawler_class)
+    with mock.patch.object(crawler_class, 'fetch_listing', return_value=make_soup(page, parse_only)):
+        crawler.collect_links()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=200, help='runs of each page')
+    args = parser.parse_args()
+
+    print(f"{'page':<18}{'parser':<13}{'strainer':<10}{'ms/page':>9}")
+    for crawler_class, name, url in crawlers:
+        news = (pages_dir / f'{name}_news.html').read_text(encoding='utf-8')
+        listing = (pages_dir / f'{name}_listing.html').read_text(encoding='utf-8')
+        cases = (
+            (f'{name}_news', lambda parse_only: news_page(crawler_class, news, url, parse_only),
+             crawler_class.news_parse_only),
+            (f'{name}_listing', lambda parse_only: listing_page(crawler_class, listing, parse_only),
+             crawler_class.links_parse_only),
+        )
+        for page_name, run, strainer in cases:
+            for html_parser in ('html.parser', 'lxml'):
+                for parse_only in ((None, strainer) if strainer is not None else (None,)):
+                    # images are not downloaded, only parsing is timed
+                    with override_settings(CRAWLER_HTML_PARSER=html_parser), \
+                            mock.patch.object(crawler_class, 'download_image', return_value=''):
+                        seconds = timeit.timeit(lambda: run(parse_only), number=args.number)
+                    print(f"{page_name:<18}{html_parser:<13}{'yes' if parse_only else 'no':<10}"
+                          f"{seconds / args.number * 1000:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
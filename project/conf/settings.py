@@ -159,7 +159,59 @@ CELERY_BROKER_URL = 'amqp://%(USER)s:%(PASS)s@%(HOST)s' % {
 # CELERY_ENABLE_UTC = False
 # DJANGO_CELERY_BEAT_TZ_AWARE = False
 
+# HTTP client shared by crawlers and wordpress handler
+HTTP_TIMEOUT = config('HTTP_TIMEOUT', default=20, cast=int)
+HTTP_MAX_RETRIES = config('HTTP_MAX_RETRIES', default=3, cast=int)
+HTTP_BACKOFF_FACTOR = config('HTTP_BACKOFF_FACTOR', default=0.5, cast=float)
+HTTP_POOL_CONNECTIONS = config('HTTP_POOL_CONNECTIONS', default=10, cast=int)
+HTTP_POOL_MAXSIZE = config('HTTP_POOL_MAXSIZE', default=16, cast=int)
+
+# Crawler
+# BeautifulSoup tree builder, "lxml" is faster but closes an open <p> before a block element inside it and drops
+# those paragraphs from news_main, news pages are only parsed the same by "html.parser"
+CRAWLER_HTML_PARSER = config('CRAWLER_HTML_PARSER', default='html.parser', cast=str)
+# news images bigger than this (bytes) are not downloaded
+CRAWLER_MAX_IMAGE_SIZE = config('CRAWLER_MAX_IMAGE_SIZE', default=10 * 1024 * 1024, cast=int)
+
+# News editing
+# number_of_changes is counted exactly up to this many changed tokens and estimated above it
+NEWS_MAX_COUNTED_CHANGES = config('NEWS_MAX_COUNTED_CHANGES', default=1000, cast=int)
+
+# seconds the group names of admin users are cached across requests, 0 disables it
+NEWS_ROLE_CACHE_TIMEOUT = config('NEWS_ROLE_CACHE_TIMEOUT', default=60, cast=int)
+
+# news changelist shows the planner estimate instead of COUNT(*) above this many rows
+NEWS_EXACT_COUNT_LIMIT = config('NEWS_EXACT_COUNT_LIMIT', default=10000, cast=int)
+
+# crawl schedule, every category page is crawled by its own task when it is due
+CRAWL_MIN_INTERVAL = config('CRAWL_MIN_INTERVAL', default=300, cast=int)
+CRAWL_MAX_INTERVAL = config('CRAWL_MAX_INTERVAL', default=7200, cast=int)
+# one crawl at a time per website, the next one starts at least CRAWL_POLITENESS_DELAY seconds after it
+CRAWL_POLITENESS_DELAY = config('CRAWL_POLITENESS_DELAY', default=10, cast=int)
+CRAWL_LOCK_TIMEOUT = config('CRAWL_LOCK_TIMEOUT', default=900, cast=int)
+CRAWL_LOCK_RETRIES = config('CRAWL_LOCK_RETRIES', default=60, cast=int)
+
+CELERY_BEAT_SCHEDULE = {
+    'schedule-crawls': {
+        'task': 'apps.news.tasks.schedule_crawls',
+        'schedule': crontab(),
+    },
+}
+
+# crawled news are clustered with the news of the last hours above this estimated similarity
+NEWS_DUPLICATE_THRESHOLD = config('NEWS_DUPLICATE_THRESHOLD', default=0.6, cast=float)
+NEWS_DUPLICATE_WINDOW = config('NEWS_DUPLICATE_WINDOW', default=72, cast=int)
+
 # Wordpress Auth
 WP_USER = config('WP_USER')
 WP_PASS = config('WP_PASS')
+# the shared JWT token is refreshed this many seconds before its expiry
+WP_TOKEN_REFRESH_MARGIN = config('WP_TOKEN_REFRESH_MARGIN', default=3600, cast=int)
+# approved news are published by publish_news_task, failed attempts are retried after 60s, 120s, 240s, ...
+WP_PUBLISH_MAX_RETRIES = config('WP_PUBLISH_MAX_RETRIES', default=5, cast=int)
+WP_PUBLISH_RETRY_DELAY = config('WP_PUBLISH_RETRY_DELAY', default=60, cast=int)
+WP_PUBLISH_LOCK_TIMEOUT = config('WP_PUBLISH_LOCK_TIMEOUT', default=300, cast=int)
+# update_published_news requests the posts modified since the last synced post minus this many hours, the overlap
+# covers the difference of the site timezone that wordpress may use for modified_after
+WP_SYNC_OVERLAP = config('WP_SYNC_OVERLAP', default=24, cast=int)
 